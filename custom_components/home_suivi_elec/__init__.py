@@ -265,6 +265,9 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
 
     hass.data[DOMAIN]["effective_options"] = effective
 
+    # entry_id : permet aux API de lister les entités HSE via l'index config_entry du registry
+    hass.data[DOMAIN]["config_entry_id"] = entry.entry_id
+
     # ========================================
 
     # 🎯 PHASE 2.7: MIGRATION STORAGE API
@@ -9,17 +9,10 @@ from ..export import ExportService
 from ..cache_manager import get_cache_manager
 from ..calculation_engine import CalculationEngine, PricingProfile
 from ..diagnostics_engine import DiagnosticsEngine
-from datetime import datetime, date
 from ..utils.json_response import json_response
 
 _LOGGER = logging.getLogger(__name__)
 
-def _json_default(obj):
-    """Serializer JSON custom pour gérer datetime/date automatiquement"""
-    if isinstance(obj, (datetime, date)):
-        return obj.isoformat()
-    raise TypeError(f"Type {type(obj)} not serializable")
-
 class HomeElecUnifiedAPIView(HomeAssistantView):
     """API REST unifiée - Données réelles backend"""
     
@@ -347,19 +340,12 @@ class HomeElecUnifiedAPIView(HomeAssistantView):
         return self._get_timestamp()
     
     def _success(self, data):
-        """Réponse succès avec données (gère datetime automatiquement)"""
-        return web.Response(
-            text=json.dumps({"error": False, "data": data}, default=_json_default),
-            content_type="application/json"
-        )
+        """Réponse succès avec données (orjson : datetime/date gérés nativement)"""
+        return json_response({"error": False, "data": data})
     
     def _error(self, status, message):
         """Réponse erreur"""
-        return web.Response(
-            text=json.dumps({"error": True, "message": message}, default=_json_default),
-            content_type="application/json",
-            status=status
-        )
+        return json_response({"error": True, "message": message}, status=status)
         
     async def handle_sensors_health(self):
         """Endpoint get_sensors_health - Diagnostic capteurs pour capteursSensor.js."""
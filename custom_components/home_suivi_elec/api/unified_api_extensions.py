@@ -3,23 +3,35 @@
 from __future__ import annotations
 
 import asyncio
-import json
+import bisect
+import contextlib
+import functools
+import heapq
 import logging
+import operator
 import os
-from datetime import datetime, date
+import re
+import time
+from collections import defaultdict
+from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, Optional, Set
+from types import MappingProxyType
+from typing import Any, Dict, Mapping, Optional, Set
 
+import orjson
 from aiohttp import web
 from homeassistant.components.http import HomeAssistantView
-from homeassistant.core import HomeAssistant
+from homeassistant.const import EVENT_HOMEASSISTANT_STOP
+from homeassistant.core import Event, HomeAssistant, callback
+from homeassistant.helpers import entity_registry as er
 
 from ..cache_manager import get_cache_manager
+from ..calculation_engine import CalculationEngine, PricingProfile
 from ..const import DOMAIN
 from ..export import ExportService
 from ..sensor_grouping import build_auto_groups, merge_with_existing
 from ..storage_manager import StorageManager
-from ..utils.json_response import json_response
+from ..utils.json_response import json_dumps_bytes as _json_bytes, json_response
 
 try:
     from ..group_totals import refresh_group_totals, refresh_group_totals_scope  # type: ignore
@@ -41,12 +53,645 @@ except Exception:
 
 _LOGGER = logging.getLogger(__name__)
 
-# Fonction helper globale pour serializer JSON
-def _json_default(obj):
-    """Serializer JSON custom pour datetime/date"""
-    if isinstance(obj, (datetime, date)):
-        return obj.isoformat()
-    raise TypeError(f"Type {type(obj)} not serializable")
+# Horodatage des réponses history : isoformat() recalculé au plus une fois par seconde
+_TS_CACHE = [0, ""]
+
+
+def _iso_timestamp() -> str:
+    """datetime.now().isoformat() à la seconde, mémorisé tant que la seconde ne change pas."""
+    now = int(time.time())
+    if now != _TS_CACHE[0]:
+        _TS_CACHE[1] = datetime.fromtimestamp(now).isoformat()
+        _TS_CACHE[0] = now
+    return _TS_CACHE[1]
+
+
+# device_class des capteurs pris en compte par le regroupement automatique
+_GROUPABLE_DEVICE_CLASSES = frozenset({"energy", "power"})
+
+
+# Ratio TTC/HT appliqué quand une seule variante de coût/prix est connue
+_VAT = 1.1
+_INV_VAT = 1.0 / _VAT
+
+
+# Suffixe TTC/HT d'un entity_id de capteur coût (délimité par "_" ou fin de chaîne)
+_SUFFIX_RE = re.compile(r"_(ttc|ht)(?=$|_)")
+
+
+def _cost_variant(entity_id: str) -> Optional[str]:
+    """'ttc', 'ht' ou None selon le suffixe de l'entity_id (TTC prioritaire)."""
+    # Cas nominal (..._cout_daily_ttc / ..._cout_daily_ht) : simple test de fin de chaîne
+    if entity_id.endswith("_ttc"):
+        return "ttc"
+    if entity_id.endswith("_ht") and "_ttc_" not in entity_id:
+        return "ht"
+    kinds = _SUFFIX_RE.findall(entity_id)
+    if "ttc" in kinds:
+        return "ttc"
+    return "ht" if kinds else None
+
+
+# Périodes acceptées par calculate_summary (ordre conservé pour le message d'erreur)
+_PERIOD_ORDER = ("hourly", "daily", "weekly", "monthly", "yearly")
+_VALID_PERIODS = frozenset(_PERIOD_ORDER)
+
+# Deltas externe - interne du summary : (clé, décimales)
+_DELTA_KEYS = (
+    ("energy_kwh", 3),
+    ("cost_ht", 2),
+    ("cost_ttc", 2),
+    ("total_ht", 2),
+    ("total_ttc", 2),
+)
+
+
+# État numérique HA ("12.5", "-3", "1e-3"...) : évite float() + exception sur unknown/unavailable
+_NUM_RE = re.compile(r"^[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?$")
+
+
+def _safe_float(value: Any) -> float:
+    """float(value) si c'est un nombre, sinon 0.0 (sans passer par une exception)."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    return float(value) if isinstance(value, str) and _NUM_RE.match(value) else 0.0
+
+
+def _safe_div(a: float, b: float, ndigits: int = 3) -> float:
+    """round(a / b, ndigits), ou 0.0 si le diviseur n'est pas strictement positif."""
+    return round(a / b, ndigits) if b > 0 else 0.0
+
+
+def _rows_energy(rows: list) -> float:
+    """Énergie d'une période : écart du cumul `sum` entre la dernière et la première ligne."""
+    return float(rows[-1].get("sum", 0.0)) - float(rows[0].get("sum", 0.0))
+
+
+def _period_rates(energy_kwh: float, cost_ttc: float, hours: float, days: float):
+    """(kWh/h, € TTC/h, kWh/j, € TTC/j) arrondis comme dans la réponse cost_analysis."""
+    return (
+        round(energy_kwh / hours, 3) if hours > 0 else 0.0,
+        round(cost_ttc / hours, 4) if hours > 0 else 0.0,
+        round(energy_kwh / days, 3) if days > 0 else 0.0,
+        round(cost_ttc / days, 4) if days > 0 else 0.0,
+    )
+
+
+def _stat_row_ts(row: Dict[str, Any]) -> float:
+    """Début d'une ligne statistics_during_period en epoch (float récent ou datetime legacy)."""
+    start = row.get("start")
+    return start.timestamp() if isinstance(start, datetime) else float(start or 0.0)
+
+
+def _slice_stats(stats: Dict[str, list], start_dt: datetime, end_dt: datetime) -> Dict[str, list]:
+    """Restreint des lignes de stats (triées par start) à [start_dt, end_dt[, comme le recorder."""
+    lo, hi = start_dt.timestamp(), end_dt.timestamp()
+    sliced = {}
+    for statistic_id, rows in stats.items():
+        i = bisect.bisect_left(rows, lo, key=_stat_row_ts)
+        j = bisect.bisect_left(rows, hi, lo=i, key=_stat_row_ts)
+        if i < j:
+            sliced[statistic_id] = rows[i:j]
+    return sliced
+
+
+# Squelettes history/costs et history/analysis : parties constantes partagées (jamais mutées)
+_ZERO_TOTALS = {"total_kwh": 0.0, "total_cost_ht": 0.0, "total_cost_ttc": 0.0}
+_HISTORY_COSTS_COMPARISON = {
+    "delta_kwh": 0.0,
+    "delta_cost_ht": 0.0,
+    "delta_cost_ttc": 0.0,
+    "delta_percent": 0.0,
+}
+_HISTORY_ANALYSIS_COMPARISON = {
+    "delta_kwh": 0.0,
+    "delta_cost_ht": 0.0,
+    "delta_cost_ttc": 0.0,
+    "delta_percent_kwh": 0.0,
+    "delta_percent_cost": 0.0,
+    "trend": "stable",
+}
+
+
+# Paramètres par défaut des POST history/costs et history/analysis (fusion en un seul dict)
+_HISTORY_COSTS_DEFAULTS = {
+    "baseline_start": None,
+    "baseline_end": None,
+    "event_start": None,
+    "event_end": None,
+    "focus_entity_id": None,
+    "group_by": "hour",
+}
+_HISTORY_ANALYSIS_DEFAULTS = {
+    **_HISTORY_COSTS_DEFAULTS,
+    "top_limit": 10,
+    "top_sort_by": "cost_ttc",
+}
+
+
+def _skeleton_template(payload: Dict[str, Any], slots: int) -> bytes:
+    """Pré-encode `payload` ; les chaînes "\\x00slotN" deviennent des %b à remplir par appel."""
+    body = orjson.dumps(payload)
+    for n in range(slots):
+        body = body.replace(orjson.dumps(f"\x00slot{n}"), b"%b", 1)
+    return body
+
+
+# Réponses squelettes pré-sérialisées (seuls les champs de la requête sont encodés par appel)
+_HISTORY_COSTS_TMPL = _skeleton_template(
+    {
+        "error": False,
+        "data": {
+            "baseline": {"start": "\x00slot0", "end": "\x00slot1", **_ZERO_TOTALS, "sensors": []},
+            "event": {"start": "\x00slot2", "end": "\x00slot3", **_ZERO_TOTALS, "sensors": []},
+            "comparison": _HISTORY_COSTS_COMPARISON,
+            "focus_entity": "\x00slot4",
+            "group_by": "\x00slot5",
+        },
+    },
+    6,
+)
+_HISTORY_ANALYSIS_TMPL = _skeleton_template(
+    {
+        "error": False,
+        "data": {
+            "baseline_period": {
+                "start": "\x00slot0", "end": "\x00slot1", **_ZERO_TOTALS, "sensor_count": 0
+            },
+            "event_period": {
+                "start": "\x00slot2", "end": "\x00slot3", **_ZERO_TOTALS, "sensor_count": 0
+            },
+            "comparison": _HISTORY_ANALYSIS_COMPARISON,
+            "by_sensor": [],
+            "timeline": [],
+            "focus_entity": "\x00slot4",
+            "parameters": {
+                "group_by": "\x00slot5",
+                "top_limit": "\x00slot6",
+                "top_sort_by": "\x00slot7",
+            },
+        },
+    },
+    8,
+)
+
+
+# Réponses JSON : corps déjà en bytes (orjson) + en-têtes pré-construits
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+@functools.lru_cache(maxsize=128)
+def _config_error_body(message: str) -> bytes:
+    """Corps {"success": false, "error": message} ; les messages récurrents (400/404) restent en cache."""
+    return orjson.dumps({"success": False, "error": message})
+
+
+# Streaming des listes à partir de ce nombre d'éléments (cf. _success_stream)
+_STREAM_MIN_ITEMS = 100
+
+# Streaming : nombre d'éléments encodés par write()
+_STREAM_CHUNK_ITEMS = 64
+
+
+async def _stream_json_success(
+    request: web.Request, data: Dict[str, Any], array_key: str
+) -> web.StreamResponse:
+    """Envoie {"error": false, "data": data} en streamant la liste data[array_key].
+
+    Le document reste un JSON valide ; seule la liste (potentiellement longue) est encodée
+    par paquets au lieu d'être matérialisée en un seul bloc. Une erreur après prepare()
+    est loggée ici et la réponse déjà engagée est renvoyée telle quelle.
+    """
+    items = data[array_key]
+    rest = {k: v for k, v in data.items() if k != array_key}
+
+    resp = web.StreamResponse(headers=_JSON_HEADERS)
+    await resp.prepare(request)
+    try:
+        await resp.write(b'{"error":false,"data":{' + orjson.dumps(array_key) + b":[")
+
+        for start in range(0, len(items), _STREAM_CHUNK_ITEMS):
+            chunk = b",".join(_json_bytes(it) for it in items[start:start + _STREAM_CHUNK_ITEMS])
+            await resp.write(chunk if start == 0 else b"," + chunk)
+
+        tail = _json_bytes(rest)[1:-1]
+        await resp.write(b"]" + (b"," + tail if tail else b"") + b"}}")
+        await resp.write_eof()
+    except Exception as e:
+        # En-têtes déjà envoyés (en pratique : client déconnecté) : plus de réponse
+        # d'erreur possible, l'appelant ne doit pas en construire une autre
+        _LOGGER.warning("Réponse JSON streamée interrompue (%s): %s", array_key, e)
+    return resp
+
+
+# Fichiers JSON legacy : indentés comme l'ancien json.dump(indent=2)
+_INDENT_OPTS = orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+
+
+# Fichiers JSON legacy (chemins fixes, aussi clés du cache / des verrous / des écritures différées)
+_DATA_DIR = Path(__file__).parent.parent / "data"
+_SELECTION_FILE = str(_DATA_DIR / "capteurs_selection.json")
+_POWER_FILE = str(_DATA_DIR / "capteurs_power.json")
+
+
+# Cache des fichiers JSON legacy : chemin -> (st_mtime_ns, st_size, contenu)
+# Toujours revalidé par os.stat (d'autres modules écrivent ces fichiers) ; nos écritures le purgent.
+# Le contenu est partagé : ne jamais le modifier en place (copie sur écriture ou _selection_copy).
+_JSON_CACHE: Dict[str, tuple] = {}
+
+
+def _cached_json_load(path: Any) -> Any:
+    """Charge un JSON en ne re-parsant que si le fichier a changé (bloquant, executor)."""
+    key = str(path)
+    st = os.stat(key)
+    cached = _JSON_CACHE.get(key)
+    if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[2]
+    data = orjson.loads(Path(key).read_bytes())
+    _JSON_CACHE[key] = (st.st_mtime_ns, st.st_size, data)
+    return data
+
+
+# entity_ids du fichier power, dérivés du contenu en cache : chemin -> (contenu, frozenset)
+_POWER_IDS_CACHE: Dict[str, tuple] = {}
+
+
+def _get_power_ids(path: Any) -> frozenset:
+    """entity_ids de capteurs_power.json, recalculés seulement si le fichier a été re-parsé."""
+    key = str(path)
+    power_data = _cached_json_load(key)
+    cached = _POWER_IDS_CACHE.get(key)
+    if cached is not None and cached[0] is power_data:
+        return cached[1]
+    power_ids = frozenset(
+        s.get("entity_id")
+        for s in (power_data or [])
+        if isinstance(s, dict) and s.get("entity_id")
+    )
+    _POWER_IDS_CACHE[key] = (power_data, power_ids)
+    return power_ids
+
+
+def _selection_copy(selection: Any) -> Any:
+    """
+    Copie d'une sélection {catégorie: [capteur, ...]} modifiable sans toucher au cache.
+
+    Les mutations (toggle, actions de validation) ne portent que sur les dicts capteur :
+    copier listes et dicts capteur suffit, bien moins coûteux qu'un deepcopy.
+    """
+    if not isinstance(selection, dict):
+        return selection
+    return {
+        category: (
+            [dict(s) if isinstance(s, dict) else s for s in sensors]
+            if isinstance(sensors, list)
+            else sensors
+        )
+        for category, sensors in selection.items()
+    }
+
+
+# Délai de regroupement des écritures JSON legacy de la vue config (secondes)
+_WRITE_DEBOUNCE_S = 0.15
+
+# Écritures JSON legacy différées : chemin -> (n° de version, données).
+# Partagé entre vues : ValidationActionView part de la version en attente.
+_PENDING_JSON_WRITES: Dict[str, tuple] = {}
+
+# Appelants en attente de leur écriture disque : chemin -> [(n° de version, future)]
+_PENDING_JSON_WAITERS: Dict[str, list] = {}
+
+# Flush des écritures en attente à l'arrêt de HA (enregistré une fois par run, hors DOMAIN)
+_JSON_FLUSH_ON_STOP_KEY = f"{DOMAIN}_legacy_json_flush_on_stop"
+
+# Un verrou par fichier JSON legacy : sérialise les lecture-modification-écriture
+# (toggle, sauvegarde, reset, actions de validation, flush différé). Lectures seules sans verrou.
+_FILE_LOCKS: Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+
+def _settle_json_waiters(
+    file_path: str, seq: Optional[int] = None, error: Optional[BaseException] = None
+) -> None:
+    """
+    Réveille les appelants dont la version (<= `seq`, toutes si None) est écrite ou absorbée.
+
+    Avec `error`, l'exception leur est transmise (réponse 500 comme une écriture directe).
+    """
+    waiters = _PENDING_JSON_WAITERS.get(file_path)
+    if not waiters:
+        return
+    remaining = []
+    for waiter_seq, fut in waiters:
+        if seq is not None and waiter_seq > seq:
+            remaining.append((waiter_seq, fut))
+        elif not fut.done():
+            if error is None:
+                fut.set_result(None)
+            else:
+                fut.set_exception(error)
+    if remaining:
+        _PENDING_JSON_WAITERS[file_path] = remaining
+    else:
+        del _PENDING_JSON_WAITERS[file_path]
+
+
+async def _flush_pending_json_writes(hass: HomeAssistant) -> None:
+    """Écrit tout de suite les versions en attente (atomique, en executor, sous verrou fichier)."""
+    # Une entrée reste visible (pour _load_json_file) tant que sa version n'est pas sur disque
+    while _PENDING_JSON_WRITES:
+        for file_path in list(_PENDING_JSON_WRITES):
+            async with _FILE_LOCKS[file_path]:
+                # Relue sous verrou : un reset / une action de validation a pu l'absorber
+                entry = _PENDING_JSON_WRITES.get(file_path)
+                if entry is None:
+                    continue
+                seq, data = entry
+                try:
+                    # Encodage (rapide, petits fichiers) sur la loop ; écriture atomique en executor
+                    body = orjson.dumps(data, option=_INDENT_OPTS)
+                    await hass.async_add_executor_job(_write_bytes_atomic, file_path, body)
+                except Exception as e:
+                    # État disque incertain : le cache sera relu (stat) à la prochaine lecture
+                    _JSON_CACHE.pop(file_path, None)
+                    _LOGGER.error("Erreur écriture %s: %s", file_path, e)
+                    _settle_json_waiters(file_path, seq, e)
+                else:
+                    _JSON_CACHE.pop(file_path, None)
+                    _settle_json_waiters(file_path, seq)
+
+                if _PENDING_JSON_WRITES.get(file_path, (None,))[0] == seq:
+                    del _PENDING_JSON_WRITES[file_path]
+
+
+def _ensure_json_flush_on_stop(hass: HomeAssistant) -> None:
+    """À l'arrêt de HA, écrit sans attendre le délai de regroupement."""
+    if hass.data.get(_JSON_FLUSH_ON_STOP_KEY):
+        return
+
+    async def _flush_on_stop(event: Event) -> None:
+        await _flush_pending_json_writes(hass)
+
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, _flush_on_stop)
+    hass.data[_JSON_FLUSH_ON_STOP_KEY] = True
+
+
+# Sélection vide pré-encodée (reset) : pas de dumps à chaque appel
+_EMPTY_SELECTION_BYTES = orjson.dumps(
+    {
+        "salle_de_bain": [],
+        "cuisine": [],
+        "chauffage": [],
+        "general": [],
+    },
+    option=orjson.OPT_INDENT_2,
+)
+
+
+def _write_bytes_atomic(file_path: str, data: bytes) -> None:
+    """
+    Écrit des bytes via fichier temporaire + os.replace (bloquant, à lancer en executor).
+
+    Un seul write() du contenu déjà encodé, fsync avant le rename : après un crash le
+    fichier est soit l'ancien, soit le nouveau complet. Temporaire suffixé du pid.
+    """
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    tmp_path = f"{file_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+
+
+# Champs cost_ha qui ne comptent pas comme un changement de config
+_COST_HA_VOLATILE_KEYS = frozenset({"last_updated", "created_at", "previous_type_contrat"})
+
+
+def _cost_ha_entry_changed(old: Any, new: Dict[str, Any]) -> bool:
+    """True si l'entrée cost_ha diffère de celle stockée (horodatages/historique ignorés)."""
+    if not isinstance(old, dict):
+        return True
+    keys = (old.keys() | new.keys()) - _COST_HA_VOLATILE_KEYS
+    return any(old.get(k) != new.get(k) for k in keys)
+
+
+# Accesseurs (attrgetter, niveau C) des attributs candidats, par ordre de priorité
+_UID_GETTERS = tuple(
+    operator.attrgetter(a) for a in ("unique_id", "_attr_unique_id", "attr_unique_id")
+)
+_SRC_GETTERS = tuple(
+    operator.attrgetter(a)
+    for a in (
+        "_source_energy_entity",
+        "source_energy_entity",
+        "source_entity",
+        "sourceenergyentity",
+        "sourceentity",
+    )
+)
+
+
+def _first_attr(ent: Any, getters: tuple) -> Optional[Any]:
+    """Première valeur non vide parmi les accesseurs, sinon None."""
+    for getter in getters:
+        try:
+            value = getter(ent)
+        except AttributeError:
+            continue
+        if value:
+            return value
+    return None
+
+
+# Évènement "capteurs coût prêts" (écouté par sensor.py) et son ancien nom sans underscores
+EVENT_COST_SENSORS_READY = "hse_cost_sensors_ready"
+_LEGACY_EVENT_COST_SENSORS_READY = "hsecostsensorsready"
+# Clé hass.data hors DOMAIN : survit à un unload/reload de l'entrée (forwarder posé une fois)
+_LEGACY_FORWARDER_KEY = f"{DOMAIN}_legacy_cost_event_forwarder"
+
+
+def _ensure_legacy_cost_event_forwarder(hass: HomeAssistant) -> None:
+    """Relaie hse_cost_sensors_ready sous l'ancien nom (sans écouteur, le fire est quasi gratuit)."""
+    if hass.data.get(_LEGACY_FORWARDER_KEY):
+        return
+
+    @callback
+    def _forward(event: Event) -> None:
+        hass.bus.async_fire(_LEGACY_EVENT_COST_SENSORS_READY, event.data)
+
+    hass.bus.async_listen(EVENT_COST_SENSORS_READY, _forward)
+    hass.data[_LEGACY_FORWARDER_KEY] = True
+
+
+def _hse_registry_entries(hass: HomeAssistant) -> list:
+    """
+    Entrées du registry de la plateforme HSE.
+
+    Passe par l'index config_entry du registry (O(entités HSE)) quand l'entry_id est connu,
+    sinon repli sur le parcours complet du registry.
+    """
+    entity_reg = er.async_get(hass)
+    entry_id = hass.data.get(DOMAIN, {}).get("config_entry_id")
+    if entry_id:
+        entries = er.async_entries_for_config_entry(entity_reg, entry_id)
+    else:
+        entries = entity_reg.entities.values()
+    return [entry for entry in entries if entry.platform == DOMAIN]
+
+
+def _get_pricing_config_cached(hass: HomeAssistant) -> Dict[str, Any]:
+    """
+    get_pricing_config mémorisé dans hass.data[DOMAIN].
+
+    async_update_entry remplace entry.data / entry.options : la clé est leur identité
+    (objets retenus par le cache), donc toute modification de l'entrée invalide sans listener.
+    """
+    from ..cost_tracking import get_pricing_config
+
+    entries = hass.config_entries.async_entries(DOMAIN)
+    if not entries:
+        return get_pricing_config(hass)
+
+    entry = entries[0]
+    domain = hass.data.setdefault(DOMAIN, {})
+    cached = domain.get("_pricing_cache")
+    if (
+        cached is not None
+        and cached[0] is entry
+        and cached[1] is entry.data
+        and cached[2] is entry.options
+    ):
+        return cached[3]
+
+    pricing = get_pricing_config(hass)
+    domain["_pricing_cache"] = (entry, entry.data, entry.options, pricing)
+    return pricing
+
+
+# Clé hass.data hors DOMAIN (reconstruit au reload) : le listener d'invalidation n'est posé qu'une fois
+_COST_INDEX_LISTENER_KEY = f"{DOMAIN}_cost_uid_index_listener"
+
+
+def _get_cost_sensor_index(hass: HomeAssistant) -> Dict[str, str]:
+    """
+    {unique_id: entity_id} des capteurs coût HSE du registry ("cout"/"cost" dans l'entity_id).
+
+    Mémorisé dans hass.data[DOMAIN] et invalidé à chaque modification du registry
+    (listener enregistré une seule fois par run HA, cf. _COST_INDEX_LISTENER_KEY).
+    """
+    domain = hass.data.setdefault(DOMAIN, {})
+    index = domain.get("_cost_uid_index")
+    if index is not None:
+        return index
+
+    if not hass.data.get(_COST_INDEX_LISTENER_KEY):
+
+        @callback
+        def _invalidate(event: Event) -> None:
+            hass.data.get(DOMAIN, {}).pop("_cost_uid_index", None)
+
+        hass.bus.async_listen(er.EVENT_ENTITY_REGISTRY_UPDATED, _invalidate)
+        hass.data[_COST_INDEX_LISTENER_KEY] = True
+
+    index = {
+        entry.unique_id: entry.entity_id
+        for entry in _hse_registry_entries(hass)
+        if entry.unique_id
+        and ("cout" in entry.entity_id or "cost" in entry.entity_id)
+    }
+    domain["_cost_uid_index"] = index
+    return index
+
+
+def _error_payload(err: Exception) -> Dict[str, Any]:
+    return {"success": False, "error": str(err)}
+
+
+def _error_message_payload(err: Exception) -> Dict[str, Any]:
+    return {"error": True, "message": str(err)}
+
+
+def _api_handler(tag: str, payload=_error_payload):
+    """
+    Enveloppe un handler get/post : toute exception non gérée est loggée (`tag`)
+    et renvoyée en 500 avec le format d'erreur de la vue (`payload`).
+    """
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(*args, **kwargs):
+            try:
+                return await handler(*args, **kwargs)
+            except Exception as e:
+                _LOGGER.exception("%s: %s", tag, e)
+                return json_response(payload(e), status=500)
+
+        return wrapper
+
+    return decorator
+
+
+def _coalesce_concurrent(handler):
+    """
+    Mutualise les appels concurrents d'une action POST coûteuse.
+
+    - même payload déjà en cours : on attend et on renvoie le résultat du premier appel
+    - payload différent : on attend la fin du calcul en cours (verrou par action)
+    """
+
+    @functools.wraps(handler)
+    async def wrapper(self, data):
+        action = handler.__name__
+        key = (action, orjson.dumps(data, default=str, option=orjson.OPT_SORT_KEYS))
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            try:
+                status, body, content_type = await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise
+                # Le premier appel a été annulé : on recalcule nous-mêmes
+            else:
+                return web.Response(body=body, status=status, content_type=content_type)
+
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        try:
+            lock = self._action_locks.setdefault(action, asyncio.Lock())
+            async with lock:
+                resp = await handler(self, data)
+            fut.set_result((resp.status, resp.body, resp.content_type))
+            return resp
+        except BaseException:
+            if not fut.done():
+                fut.cancel()
+            raise
+        finally:
+            if self._inflight.get(key) is fut:
+                del self._inflight[key]
+
+    return wrapper
+
+
+def _alias_dispatch(handlers: Dict[str, str], aliases: Dict[str, str]) -> Mapping[str, str]:
+    """Table action -> nom de méthode, alias inclus (résolue une fois à l'import, lecture seule)."""
+    dispatch = dict(handlers)
+    for alias, canonical in aliases.items():
+        if canonical in handlers:
+            dispatch[alias] = handlers[canonical]
+    return MappingProxyType(dispatch)
+
+
+def _bind_handlers(view: Any, dispatch: Mapping[str, str]) -> Dict[str, Any]:
+    """Action -> méthode liée de `view` (résolue une fois par instance, pas de getattr par requête)."""
+    return {action: getattr(view, name) for action, name in dispatch.items()}
+
 
 class HomeElecUnifiedConfigAPIView(HomeAssistantView):
     """API Configuration - Méthodes POST/GET pour gestion config"""
@@ -58,9 +703,7 @@ class HomeElecUnifiedConfigAPIView(HomeAssistantView):
 
     _GET_ALIASES = {
         "costsensorsstatus": "cost_sensors_status",
-        "cost_sensors_status": "cost_sensors_status",
         "exportcostyaml": "export_cost_yaml",
-        "export_cost_yaml": "export_cost_yaml",
     }
 
     _POST_ALIASES = {
@@ -72,15 +715,35 @@ class HomeElecUnifiedConfigAPIView(HomeAssistantView):
         "savegroups": "save_groups",
         "savegroupsets": "save_group_sets",
         "generatecostsensors": "generate_cost_sensors",
-        "generate_cost_sensors": "generate_cost_sensors",
         "calculatesummary": "calculate_summary",
-        "calculate_summary": "calculate_summary",
-        "set_cost_ha": "set_cost_ha",
         "setcostha": "set_cost_ha",
         "refreshgrouptotals": "refresh_group_totals",
-        "refresh_group_totals": "refresh_group_totals",
     }
 
+    # Action canonique -> méthode handler
+    _POST_HANDLERS = {
+        "save_selection": "_save_sensor_selection",
+        "update_options": "_update_integration_options",
+        "toggle_sensor": "_toggle_sensor_state",
+        "reset_config": "_reset_configuration",
+        "auto_group": "_auto_group_sensors",
+        "save_groups": "_save_sensor_groups",
+        "generate_cost_sensors": "_generate_cost_sensors",
+        "calculate_summary": "_calculate_summary_metrics",
+        "enable_sensor": "_enable_sensor",
+        "save_group_sets": "_save_group_sets",
+        "refresh_group_totals": "_refresh_group_totals",
+    }
+
+    _GET_HANDLERS = {
+        "cost_sensors_status": "get_cost_sensors_status",
+        "export_cost_yaml": "_export_cost_sensors_yaml",
+    }
+
+    # Alias + canoniques -> handler, en un seul lookup
+    _POST_DISPATCH = _alias_dispatch(_POST_HANDLERS, _POST_ALIASES)
+    _GET_DISPATCH = _alias_dispatch(_GET_HANDLERS, _GET_ALIASES)
+
     # ✅ AJOUT : Méthode pour activer un capteur
     async def _enable_sensor(self, data):
         """Active un capteur désactivé dans l'entity_registry."""
@@ -104,7 +767,7 @@ class HomeElecUnifiedConfigAPIView(HomeAssistantView):
             # Activer l'entité
             entity_reg.async_update_entity(entity_id, disabled_by=None)
             
-            _LOGGER.info(f"✅ Entity {entity_id} enabled by user via HSE")
+            _LOGGER.info("✅ Entity %s enabled by user via HSE", entity_id)
             
             return self._success({
                 "message": f"Entity {entity_id} enabled successfully. A restart or reload may be required.",
@@ -119,6 +782,27 @@ class HomeElecUnifiedConfigAPIView(HomeAssistantView):
     def __init__(self, hass: HomeAssistant):
         self.hass = hass
         self.export_service = ExportService(hass)
+        # Moteur sans état par requête : une instance pour toute la vie de la vue
+        self._engine = CalculationEngine(hass)
+        # Coalescing des actions coûteuses (cf. _coalesce_concurrent)
+        self._inflight: Dict[tuple, asyncio.Future] = {}
+        self._action_locks: Dict[str, asyncio.Lock] = {}
+        _ensure_legacy_cost_event_forwarder(hass)
+        # Écritures JSON legacy différées et regroupées (cf. _save_json_file)
+        self._pending_writes = _PENDING_JSON_WRITES
+        self._write_seq = 0
+        self._flush_task: Optional[asyncio.Task] = None
+        _ensure_json_flush_on_stop(hass)
+        # Index entity_id -> (catégorie, position) de la dernière sélection (cf. _get_selection_index)
+        self._selection_index_src: Optional[Dict[str, Any]] = None
+        self._selection_index: Dict[str, tuple] = {}
+        # Tables de dispatch en méthodes liées (alias inclus)
+        self._post_dispatch = _bind_handlers(self, self._POST_DISPATCH)
+        self._get_dispatch = _bind_handlers(self, self._GET_DISPATCH)
+        # Les handlers GET reçoivent la requête ; get_cost_sensors_status (API publique) n'en a pas besoin
+        for action, name in self._GET_DISPATCH.items():
+            if name == "get_cost_sensors_status":
+                self._get_dispatch[action] = lambda request: self.get_cost_sensors_status()
         _LOGGER.info("API Configuration initialisée")
 
     # -------------------------
@@ -127,20 +811,21 @@ class HomeElecUnifiedConfigAPIView(HomeAssistantView):
 
     def _success(self, data: Any, status: int = 200) -> web.Response:
         return web.Response(
-            text=json.dumps({"error": False, "data": data}, default=_json_default),
-            content_type="application/json",
+            body=_json_bytes({"error": False, "data": data}),
+            headers=_JSON_HEADERS,
             status=status
         )
 
     def _error(self, status: int, message: str) -> web.Response:
         return web.Response(
-            text=json.dumps({"success": False, "error": message}, default=_json_default),
-            content_type="application/json",
+            body=_config_error_body(message),
+            headers=_JSON_HEADERS,
             status=status
         )
 
-
-    async def _get_storage_manager(self) -> StorageManager:
+    def _get_storage_manager(self) -> StorageManager:
+        # Relu à chaque appel (pas de cache sur la vue) : un reload de l'entrée publie une
+        # nouvelle instance dans hass.data alors que la vue, elle, reste enregistrée.
         data = self.hass.data.get(DOMAIN, {})
         mgr = data.get("storage_manager")
         if isinstance(mgr, StorageManager):
@@ -148,6 +833,7 @@ class HomeElecUnifiedConfigAPIView(HomeAssistantView):
         return StorageManager(self.hass)
 
     def _get_timestamp(self) -> str:
+        # Précision microseconde conservée : sert aussi d'horodatage persisté (store cost_ha)
         return datetime.now().isoformat()
 
     # -------------
@@ -159,7 +845,7 @@ class HomeElecUnifiedConfigAPIView(HomeAssistantView):
         try:
             if action is None:
                 action = request.match_info.get("action", "unknown")
-            action = self._POST_ALIASES.get(action, action)
+            handler = self._post_dispatch.get(action)
 
             _LOGGER.info("API Config POST: /%s", action)
 
@@ -168,38 +854,8 @@ class HomeElecUnifiedConfigAPIView(HomeAssistantView):
             except Exception as e:
                 return self._error(400, f"JSON invalide: {e}")
 
-            if action == "save_selection":
-                return await self._save_sensor_selection(data)
-
-            if action == "update_options":
-                return await self._update_integration_options(data)
-
-            if action == "toggle_sensor":
-                return await self._toggle_sensor_state(data)
-
-            if action == "reset_config":
-                return await self._reset_configuration(data)
-
-            if action == "auto_group":
-                return await self._auto_group_sensors(data)
-
-            if action == "save_groups":
-                return await self._save_sensor_groups(data)
-
-            if action == "generate_cost_sensors":
-                return await self._generate_cost_sensors(data)
-
-            if action == "calculate_summary":
-                return await self._calculate_summary_metrics(data)
-
-            if action == "enable_sensor":
-                return await self._enable_sensor(data)
-
-            if action == "save_group_sets":
-                return await self._save_group_sets(data)
-
-            if action == "refresh_group_totals":
-                return await self._refresh_group_totals(data)
+            if handler is not None:
+                return await handler(data)
 
             return self._error(404, f"Action POST inconnue: {action}")
 
@@ -213,14 +869,11 @@ class HomeElecUnifiedConfigAPIView(HomeAssistantView):
             if action is None:
                 action = request.match_info.get("action", "unknown")
 
-            action = self._GET_ALIASES.get(action, action)
+            handler = self._get_dispatch.get(action)
             _LOGGER.info("API Config GET: /%s", action)
 
-            if action == "cost_sensors_status":
-                return await self.get_cost_sensors_status()
-
-            if action == "export_cost_yaml":
-                return await self._export_cost_sensors_yaml()
+            if handler is not None:
+                return await handler(request)
 
             return self._error(404, f"Action GET inconnue: {action}")
 
@@ -252,7 +905,9 @@ class HomeElecUnifiedConfigAPIView(HomeAssistantView):
                         return self._error(400, "Chaque capteur doit avoir un 'entity_id'")
 
             selection_file = self._get_selection_file_path()
-            await self._save_json_file(selection_file, selection)
+            async with _FILE_LOCKS[selection_file]:
+                written = self._queue_json_write(selection_file, selection)
+            await written
 
             return self._success(
                 {
@@ -316,24 +971,24 @@ class HomeElecUnifiedConfigAPIView(HomeAssistantView):
             enabled = bool(enabled)
 
             selection_file = self._get_selection_file_path()
-            selection = await self._load_json_file(selection_file)
+            async with _FILE_LOCKS[selection_file]:
+                # Contenu partagé (cache / écriture en attente) : jamais modifié en place
+                selection = await self._load_json_file(selection_file) or {}
 
-            sensor_found = False
-            for _category, sensors in (selection or {}).items():
-                if not isinstance(sensors, list):
-                    continue
-                for sensor in sensors:
-                    if sensor.get("entity_id") == entity_id:
-                        sensor["enabled"] = enabled
-                        sensor_found = True
-                        break
-                if sensor_found:
-                    break
+                position = self._get_selection_index(selection).get(entity_id)
+                if position is None:
+                    return self._error(404, f"Capteur {entity_id} introuvable")
+                category, i = position
 
-            if not sensor_found:
-                return self._error(404, f"Capteur {entity_id} introuvable")
+                # Copie sur écriture : seuls la liste de la catégorie et le dict capteur sont dupliqués
+                sensors = list(selection[category])
+                sensors[i] = {**sensors[i], "enabled": enabled}
+                selection = {**selection, category: sensors}
+                # Positions inchangées : l'index reste valide pour la nouvelle version
+                self._selection_index_src = selection
 
-            await self._save_json_file(selection_file, selection)
+                written = self._queue_json_write(selection_file, selection)
+            await written
 
             return self._success(
                 {
@@ -354,13 +1009,20 @@ class HomeElecUnifiedConfigAPIView(HomeAssistantView):
 
             if reset_type == "selection":
                 selection_file = self._get_selection_file_path()
-                empty_selection = {
-                    "salle_de_bain": [],
-                    "cuisine": [],
-                    "chauffage": [],
-                    "general": [],
-                }
-                await self._save_json_file(selection_file, empty_selection)
+                # Écriture atomique immédiate : annule toute écriture différée de la sélection
+                async with _FILE_LOCKS[selection_file]:
+                    self._pending_writes.pop(selection_file, None)
+                    try:
+                        await self.hass.async_add_executor_job(
+                            _write_bytes_atomic, selection_file, _EMPTY_SELECTION_BYTES
+                        )
+                    except Exception as e:
+                        _settle_json_waiters(selection_file, error=e)
+                        raise
+                    finally:
+                        _JSON_CACHE.pop(selection_file, None)
+                    # Versions en attente remplacées par le reset : leurs appelants sont libérés
+                    _settle_json_waiters(selection_file)
                 message = "Sélection réinitialisée"
 
             elif reset_type == "options":
@@ -391,30 +1053,26 @@ class HomeElecUnifiedConfigAPIView(HomeAssistantView):
         Retourne le statut des sensors coût existants.
         """
         try:
-            mgr = await self._get_storage_manager()
+            mgr = self._get_storage_manager()
             user_cfg = await mgr.get_user_config()
             runtime_enabled = bool(user_cfg.get("enable_cost_sensors_runtime", False))
 
-            from homeassistant.helpers import entity_registry as er
-
-            entity_reg = er.async_get(self.hass)
+            # Index unique des états sensor (la plateforme HSE ne crée que des sensors)
+            states_by_id = {st.entity_id: st for st in self.hass.states.async_all("sensor")}
 
             cost_sensors = []
-            for entity_id, entry in entity_reg.entities.items():
-                if entry.platform == DOMAIN and (
-                    "cout" in entity_id.lower() or "cost" in entity_id.lower()
-                ):
-                    state = self.hass.states.get(entity_id)
-                    cost_sensors.append(
-                        {
-                            "entity_id": entity_id,
-                            "unique_id": entry.unique_id,
-                            "state": state.state if state else "unknown",
-                            "unit": (
-                                state.attributes.get("unit_of_measurement") if state else None
-                            ),
-                        }
-                    )
+            for unique_id, entity_id in _get_cost_sensor_index(self.hass).items():
+                state = states_by_id.get(entity_id)
+                cost_sensors.append(
+                    {
+                        "entity_id": entity_id,
+                        "unique_id": unique_id,
+                        "state": state.state if state else "unknown",
+                        "unit": (
+                            state.attributes.get("unit_of_measurement") if state else None
+                        ),
+                    }
+                )
 
             return self._success(
                 {"runtime_enabled": runtime_enabled, "count": len(cost_sensors), "sensors": cost_sensors}
@@ -425,31 +1083,24 @@ class HomeElecUnifiedConfigAPIView(HomeAssistantView):
             return self._error(500, str(e))
 
     def _entity_unique_id(self, ent: Any) -> Optional[str]:
-        return (
-            getattr(ent, "unique_id", None)
-            or getattr(ent, "_attr_unique_id", None)
-            or getattr(ent, "attr_unique_id", None)
-        )
+        return _first_attr(ent, _UID_GETTERS)
 
     def _entity_source_energy(self, ent: Any) -> Optional[str]:
         # cost_tracking.HSECostSensor stocke la source dans _source_energy_entity + attrs compat [file:11]
-        return (
-            getattr(ent, "_source_energy_entity", None)
-            or getattr(ent, "source_energy_entity", None)
-            or getattr(ent, "source_entity", None)
-            or getattr(ent, "sourceenergyentity", None)
-            or getattr(ent, "sourceentity", None)
-        )
+        return _first_attr(ent, _SRC_GETTERS)
 
+    @_coalesce_concurrent
     async def _generate_cost_sensors(self, data):
-        _LOGGER.warning("HSE-TRACE: _generate_cost_sensors CALLED avec data=%s", data)
         """Crée les capteurs coût HSE et les ajoute via event-driven (sans reload)."""
-        from homeassistant.helpers import entity_registry as er
+        # Trace de diagnostic : payload complet, formaté seulement si DEBUG actif
+        _LOGGER.debug("HSE-TRACE: _generate_cost_sensors CALLED avec data=%s", data)
 
         try:
             data = data or {}
+            # Horodatage logique unique pour toute la requête (entrées persistées + event)
+            now_iso = self._get_timestamp()
 
-            mgr = await self._get_storage_manager()
+            mgr = self._get_storage_manager()
             user_cfg = await mgr.get_user_config()
             runtime_enabled = bool(user_cfg.get("enable_cost_sensors_runtime", False))
 
@@ -464,8 +1115,7 @@ class HomeElecUnifiedConfigAPIView(HomeAssistantView):
             # ══════════════════════════════════════════════════════════════════
 
             # Lire la config pricing depuis config_entries (pour détecter type_contrat)
-            from ..cost_tracking import get_pricing_config
-            pricing_config = get_pricing_config(self.hass)
+            pricing_config = _get_pricing_config_cached(self.hass)
             type_contrat = pricing_config.get("type_contrat", "fixe")
 
             # Prix depuis payload API (priorité) ou depuis config_entries (fallback)
@@ -478,12 +1128,13 @@ class HomeElecUnifiedConfigAPIView(HomeAssistantView):
                 prix_ttc = float(pricing_config.get("prix_ttc", 0.0))
 
             # Allowlist optionnelle depuis le store cost_ha (Coût: oui)
-            cost_ha_map = await mgr.get_cost_ha_config()
-            allowed_sources: Set[str] = {
-                str(entity_id)
-                for entity_id, cfg in (cost_ha_map or {}).items()
-                if isinstance(cfg, dict) and bool(cfg.get("enabled", False))
-            }
+            # (clés du store JSON déjà en str, "enabled" testé en vérité directement)
+            cost_ha_map = await mgr.get_cost_ha_config() or {}
+            allowed_sources: frozenset = frozenset(
+                eid
+                for eid, cfg in cost_ha_map.items()
+                if isinstance(cfg, dict) and cfg.get("enabled")
+            )
             use_allowlist = len(allowed_sources) > 0
 
             _LOGGER.info(
@@ -505,13 +1156,10 @@ class HomeElecUnifiedConfigAPIView(HomeAssistantView):
             cost_sensors = [e for e in (cost_sensors or []) if e is not None]
 
             # Filet de sécurité: si allowlist active, on vérifie encore la source
+            # (écarte aussi les agrégats HP/HC, sans source énergie propre)
             if use_allowlist:
-                filtered = []
-                for e in cost_sensors:
-                    src = self._entity_source_energy(e)
-                    if src and src in allowed_sources:
-                        filtered.append(e)
-                cost_sensors = filtered
+                source_of = self._entity_source_energy
+                cost_sensors = [e for e in cost_sensors if source_of(e) in allowed_sources]
 
             if not cost_sensors:
                 return self._success(
@@ -544,7 +1192,7 @@ class HomeElecUnifiedConfigAPIView(HomeAssistantView):
                 len(cost_sensors)
             )
 
-            cost_ha_map = cost_ha_map or {}
+            pending: Dict[str, Dict[str, Any]] = {}
 
             for e in cost_sensors:
                 src = self._entity_source_energy(e)
@@ -575,26 +1223,34 @@ class HomeElecUnifiedConfigAPIView(HomeAssistantView):
                     "variant": attrs.get("variant", "ht"),
                     "tarif_type": attrs.get("tarif_type"),
                     "price_per_kwh": attrs.get("price_per_kwh", 0.0),
-                    "last_updated": self._get_timestamp(),
+                    "last_updated": now_iso,
                 }
                 
                 # Garder l'ancienne config si elle existe (pour tracer l'historique)
                 old_entry = cost_ha_map.get(src)
                 if isinstance(old_entry, dict):
                     entry["previous_type_contrat"] = old_entry.get("type_contrat")
-                    entry["created_at"] = old_entry.get("created_at", entry["last_updated"])
+                    entry["created_at"] = old_entry.get("created_at", now_iso)
                 else:
-                    entry["created_at"] = entry["last_updated"]
+                    entry["created_at"] = now_iso
                 
-                cost_ha_map[src] = entry
+                pending[src] = entry
+
+            # Ne persister que les sources dont la config a réellement changé
+            updates = {
+                src: entry
+                for src, entry in pending.items()
+                if _cost_ha_entry_changed(cost_ha_map.get(src), entry)
+            }
 
             # Sauvegarder AVANT la dédup pour garantir la création du fichier
-            if cost_ha_map:
+            if updates:
                 try:
-                    await mgr.save_cost_ha_config(cost_ha_map)
+                    await mgr.merge_cost_ha_config(updates)
                     _LOGGER.info(
-                        "[API-CONFIG] ✅ Store cost_ha mis à jour : %d sources persistées (type=%s)",
-                        len(cost_ha_map),
+                        "[API-CONFIG] ✅ Store cost_ha mis à jour : %d/%d sources modifiées (type=%s)",
+                        len(updates),
+                        len(pending),
                         type_contrat,
                     )
                 except Exception as e:
@@ -607,14 +1263,13 @@ class HomeElecUnifiedConfigAPIView(HomeAssistantView):
             domain = self.hass.data.setdefault(DOMAIN, {})
 
             # Dédup robuste: mémoire runtime + entity_registry
-            already: Set[str] = set(domain.get("_added_cost_uids", set()))
-            entity_reg = er.async_get(self.hass)
-            for entity_id, entry in entity_reg.entities.items():
-                if entry.platform != DOMAIN:
-                    continue
-                if ("cout" in entity_id.lower()) or ("cost" in entity_id.lower()):
-                    if entry.unique_id:
-                        already.add(entry.unique_id)
+            # (union permanente, maintenue en place : l'index registry n'y est fusionné
+            # que lorsqu'il a été reconstruit depuis la dernière génération)
+            already: Set[str] = domain.setdefault("_added_cost_uids", set())
+            cost_index = _get_cost_sensor_index(self.hass)
+            if domain.get("_added_cost_uids_index") is not cost_index:
+                already.update(cost_index)
+                domain["_added_cost_uids_index"] = cost_index
 
             to_add = []
             dup = 0
@@ -631,8 +1286,6 @@ class HomeElecUnifiedConfigAPIView(HomeAssistantView):
                 to_add.append(e)
                 already.add(uid)
 
-            domain["_added_cost_uids"] = already
-
             if not to_add:
                 return self._success(
                     {
@@ -656,11 +1309,11 @@ class HomeElecUnifiedConfigAPIView(HomeAssistantView):
             payload = {
                 "type": "cost",
                 "count": len(to_add),
-                "timestamp": self._get_timestamp(),
+                "timestamp": now_iso,
             }
 
-            self.hass.bus.async_fire("hse_cost_sensors_ready", payload)
-            self.hass.bus.async_fire("hsecostsensorsready", payload)
+            # L'alias legacy est relayé par _ensure_legacy_cost_event_forwarder
+            self.hass.bus.async_fire(EVENT_COST_SENSORS_READY, payload)
 
             return self._success(
                 {
@@ -681,55 +1334,65 @@ class HomeElecUnifiedConfigAPIView(HomeAssistantView):
             _LOGGER.exception("[API-CONFIG] Erreur generate_cost_sensors: %s", e)
             return self._error(500, f"Erreur génération sensors coût: {e}")
 
-    async def _export_cost_sensors_yaml(self):
+    async def _export_cost_sensors_yaml(self, request):
         """
         GET /api/home_suivi_elec/config/export_cost_yaml
-        Génère le YAML d'export des capteurs coût.
+        Génère le YAML d'export des capteurs coût, envoyé en flux (un morceau par capteur).
         """
+        resp = None
         try:
             _LOGGER.info("[EXPORT] Génération YAML capteurs coût...")
-            yaml_content = await self.export_service.generate_cost_sensors_yaml()
-
-            if not yaml_content:
-                return self._error(500, "Aucun contenu YAML généré")
-
-            return web.Response(
-                text=yaml_content,
-                content_type="text/yaml; charset=utf-8",
-                headers={"Content-Disposition": 'attachment; filename="cost_sensors.yaml"'},
+            chunks = self.export_service.iter_cost_sensors_yaml()
+            # Premier morceau avant prepare() : une erreur de lecture reste une réponse 500 JSON
+            first = await chunks.__anext__()
+
+            resp = web.StreamResponse(
+                headers={
+                    "Content-Type": "text/yaml; charset=utf-8",
+                    "Content-Disposition": 'attachment; filename="cost_sensors.yaml"',
+                }
             )
+            await resp.prepare(request)
+            await resp.write(first.encode("utf-8"))
+            async for chunk in chunks:
+                await resp.write(chunk.encode("utf-8"))
+            await resp.write_eof()
+            return resp
 
         except Exception as e:
             _LOGGER.exception("[EXPORT] Erreur génération YAML: %s", e)
+            if resp is not None and resp.prepared:
+                # En-têtes déjà envoyés (en pratique : client déconnecté), plus de corps JSON possible
+                return resp
             return self._error(500, f"Erreur export YAML: {e}")
 
     # -------------------------
     # Groupes (auto + save)
     # -------------------------
 
+    @_coalesce_concurrent
     async def _auto_group_sensors(self, data):
         """
         Calcule automatiquement les groupes de capteurs (energy/power)
         et les fusionne avec la config existante (store sensor_groups).
         """
         try:
-            mgr = await self._get_storage_manager()
+            mgr = self._get_storage_manager()
 
-            all_states = self.hass.states.async_all("sensor")
             sensors = []
-            for state in all_states:
-                attrs = state.attributes or {}
-                device_class = attrs.get("device_class")
-                if device_class not in ("energy", "power"):
+            for state in self.hass.states.async_all("sensor"):
+                ag = (state.attributes or {}).get
+                device_class = ag("device_class")
+                if device_class not in _GROUPABLE_DEVICE_CLASSES:
                     continue
 
                 sensors.append(
                     {
                         "entity_id": state.entity_id,
                         "device_class": device_class,
-                        "integration": attrs.get("integration", "unknown"),
-                        "area": attrs.get("area_id") or None,
-                        "friendly_name": attrs.get("friendly_name", state.entity_id),
+                        "integration": ag("integration", "unknown"),
+                        "area": ag("area_id") or None,
+                        "friendly_name": ag("friendly_name", state.entity_id),
                         "is_energy": device_class == "energy",
                         "is_power": device_class == "power",
                     }
@@ -758,7 +1421,7 @@ class HomeElecUnifiedConfigAPIView(HomeAssistantView):
     async def _save_sensor_groups(self, data):
         """Sauvegarde des groupes envoyés depuis le frontend (édition manuelle)."""
         try:
-            mgr = await self._get_storage_manager()
+            mgr = self._get_storage_manager()
             groups = (data or {}).get("groups")
 
             if not isinstance(groups, dict):
@@ -777,7 +1440,7 @@ class HomeElecUnifiedConfigAPIView(HomeAssistantView):
     async def _save_group_sets(self, data):
         """Sauvegarde du document canon group_sets (rooms/types/...)."""
         try:
-            mgr = await self._get_storage_manager()
+            mgr = self._get_storage_manager()
             group_sets = (data or {}).get("group_sets")
 
             if not isinstance(group_sets, dict):
@@ -855,17 +1518,14 @@ class HomeElecUnifiedConfigAPIView(HomeAssistantView):
             if not isinstance(pricing_config, dict):
                 return self._error(400, "'pricing_config' requis (objet)")
 
-            valid_periods = ["hourly", "daily", "weekly", "monthly", "yearly"]
-            invalid_periods = [p for p in periods if p not in valid_periods]
+            invalid_periods = [p for p in periods if p not in _VALID_PERIODS]
             if invalid_periods:
                 return self._error(
                     400,
-                    f"Périodes invalides: {invalid_periods}. Valeurs autorisées: {valid_periods}",
+                    f"Périodes invalides: {invalid_periods}. Valeurs autorisées: {list(_PERIOD_ORDER)}",
                 )
 
-            from ..calculation_engine import CalculationEngine, PricingProfile
-
-            engine = CalculationEngine(self.hass)
+            engine = self._engine
             profile = PricingProfile(pricing_config)
 
             results = {
@@ -875,31 +1535,38 @@ class HomeElecUnifiedConfigAPIView(HomeAssistantView):
                 "timestamp": self._get_timestamp(),
             }
 
-            for period in periods:
-                internal = await engine.get_group_metrics(
+            # Requêtes indépendantes : toutes les périodes (interne + externe) en parallèle
+            internal_tasks = [
+                engine.get_group_metrics(
                     group_key="internal",
                     period=period,
                     pricing_profile=profile,
                     entity_ids=entity_ids,
                 )
+                for period in periods
+            ]
+            external_tasks = [
+                engine.get_group_metrics(
+                    group_key="external",
+                    period=period,
+                    pricing_profile=profile,
+                    entity_ids=[external_id],
+                )
+                for period in periods
+            ] if external_id else []
+
+            metrics = await asyncio.gather(*internal_tasks, *external_tasks)
+            internal_metrics = metrics[:len(periods)]
+            external_metrics = metrics[len(periods):]
+
+            for period, internal in zip(periods, internal_metrics):
                 results["internal"][period] = internal
 
-                if external_id:
-                    external = await engine.get_group_metrics(
-                        group_key="external",
-                        period=period,
-                        pricing_profile=profile,
-                        entity_ids=[external_id],
-                    )
-                    results["external"][period] = external
-
-                    results["delta"][period] = {
-                        "energy_kwh": round(external["energy_kwh"] - internal["energy_kwh"], 3),
-                        "cost_ht": round(external["cost_ht"] - internal["cost_ht"], 2),
-                        "cost_ttc": round(external["cost_ttc"] - internal["cost_ttc"], 2),
-                        "total_ht": round(external["total_ht"] - internal["total_ht"], 2),
-                        "total_ttc": round(external["total_ttc"] - internal["total_ttc"], 2),
-                    }
+            for period, internal, external in zip(periods, internal_metrics, external_metrics):
+                results["external"][period] = external
+                results["delta"][period] = {
+                    key: round(external[key] - internal[key], ndigits) for key, ndigits in _DELTA_KEYS
+                }
 
             _LOGGER.info("[CALCULATE-SUMMARY] Terminé (%s périodes)", len(periods))
             return self._success(results)
@@ -913,30 +1580,69 @@ class HomeElecUnifiedConfigAPIView(HomeAssistantView):
     # -------------------------
 
     async def _load_json_file(self, file_path: str) -> Dict[str, Any]:
+        # Écriture encore en attente : c'est elle la version courante du fichier
+        pending = self._pending_writes.get(file_path)
+        if pending is not None:
+            return pending[1]
+
+        # Lecture toujours revalidée par os.stat en executor : manage_selection_views et
+        # sensor_sync_manager écrivent aussi ces fichiers, un hit sans stat serait périmé
         def _load():
             if not os.path.exists(file_path):
                 return {}
             try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    return json.load(f)
+                # Objet partagé avec le cache : les appelants ne le modifient pas en place
+                return _cached_json_load(file_path)
             except Exception as e:
                 _LOGGER.error("Erreur lecture %s: %s", file_path, e)
                 return {}
 
-        return await asyncio.get_event_loop().run_in_executor(None, _load)
+        return await self.hass.async_add_executor_job(_load)
+
+    def _queue_json_write(self, file_path: str, data: Any) -> asyncio.Future:
+        """
+        Planifie l'écriture de `data` (objet JSON) dans `file_path` (appel sous _FILE_LOCKS).
+
+        Les écritures rapprochées (ex : plusieurs toggles depuis l'UI) sont regroupées :
+        seule la dernière version de chaque fichier est écrite, _WRITE_DEBOUNCE_S plus tard.
 
-    async def _save_json_file(self, file_path: str, data: Any) -> None:
-        def _save():
-            os.makedirs(os.path.dirname(file_path), exist_ok=True)
-            with open(file_path, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+        Retourne un future résolu une fois cette version (ou une plus récente) sur disque,
+        en erreur si l'écriture échoue. À attendre APRÈS avoir relâché le verrou fichier
+        (le flush le prend) : l'appelant ne répond succès qu'une fois les données écrites.
+        """
+        self._write_seq += 1
+        self._pending_writes[file_path] = (self._write_seq, data)
+        written = self.hass.loop.create_future()
+        _PENDING_JSON_WAITERS.setdefault(file_path, []).append((self._write_seq, written))
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = self.hass.async_create_task(self._flush_pending_writes())
+        return written
+
+    async def _flush_pending_writes(self) -> None:
+        await asyncio.sleep(_WRITE_DEBOUNCE_S)
+        await _flush_pending_json_writes(self.hass)
+
+    def _get_selection_index(self, selection: Dict[str, Any]) -> Dict[str, tuple]:
+        """
+        entity_id -> (catégorie, position) du capteur (1re occurrence) dans `selection`.
 
-        await asyncio.get_event_loop().run_in_executor(None, _save)
+        Mémorisé pour l'objet sélection courant ; un toggle ne déplace aucun capteur,
+        l'index est donc reporté sur la version qu'il produit (pas de re-parcours).
+        """
+        if selection is not self._selection_index_src:
+            index: Dict[str, tuple] = {}
+            for category, sensors in selection.items():
+                if not isinstance(sensors, list):
+                    continue
+                for i, sensor in enumerate(sensors):
+                    if isinstance(sensor, dict) and sensor.get("entity_id"):
+                        index.setdefault(sensor["entity_id"], (category, i))
+            self._selection_index_src = selection
+            self._selection_index = index
+        return self._selection_index
 
     def _get_selection_file_path(self) -> str:
-        return os.path.normpath(
-            os.path.join(os.path.dirname(__file__), "..", "data", "capteurs_selection.json")
-        )
+        return _SELECTION_FILE
 
 
 class ValidationActionView(HomeAssistantView):
@@ -953,108 +1659,101 @@ class ValidationActionView(HomeAssistantView):
     def __init__(self, hass: HomeAssistant):
         self.hass = hass
 
+    @_api_handler("[VALIDATION-ACTION] POST error", _error_message_payload)
     async def post(self, request):
-        try:
-            data = await request.json()
-            action = (data or {}).get("action")
-
-            selection_file = Path(__file__).parent.parent / "data" / "capteurs_selection.json"
-            power_file = Path(__file__).parent.parent / "data" / "capteurs_power.json"
-
-            def _apply_action():
-                with open(selection_file, "r", encoding="utf-8") as f:
-                    selection_data = json.load(f)
-
-                with open(power_file, "r", encoding="utf-8") as f:
-                    power_data = json.load(f)
+        data = await request.json()
+        action = (data or {}).get("action")
+
+        def _load_selection(pending):
+            # Copie (modifiée puis réécrite) de la version en attente d'écriture, sinon du
+            # fichier revalidé par stat (cache re-parsé s'il a changé)
+            return _selection_copy(pending[1] if pending is not None else _cached_json_load(_SELECTION_FILE))
+
+        def _apply_action():
+            result = {"success": True, "action": action, "changes": [], "errors": []}
+            changes = result["changes"]
+
+            # Vue à plat (catégorie ignorée) : une seule passe par action
+            all_items = [
+                item
+                for items in selection_data.values()
+                if isinstance(items, list)
+                for item in items
+            ]
+            contains = power_ids.__contains__
+
+            if action == "disable_orphans":
+                for item in all_items:
+                    if item.get("enabled") and not contains(item.get("entity_id")):
+                        item["enabled"] = False
+                        changes.append(
+                            {"entity_id": item.get("entity_id"), "action": "disabled", "reason": "orphan"}
+                        )
+                result["message"] = f"{len(changes)} capteur(s) orphelin(s) désactivé(s)"
+
+            elif action == "enable_available":
+                for item in all_items:
+                    if (not item.get("enabled")) and contains(item.get("entity_id")):
+                        item["enabled"] = True
+                        changes.append(
+                            {"entity_id": item.get("entity_id"), "action": "enabled", "reason": "available"}
+                        )
+                result["message"] = f"{len(changes)} capteur(s) activé(s)"
+
+            elif action == "full_sync":
+                for item in all_items:
+                    entity_id = item.get("entity_id")
+                    should_be_enabled = contains(entity_id)
+                    if item.get("enabled", False) != should_be_enabled:
+                        item["enabled"] = should_be_enabled
+                        changes.append(
+                            {
+                                "entity_id": entity_id,
+                                "action": "enabled" if should_be_enabled else "disabled",
+                                "reason": "sync",
+                            }
+                        )
+                result["message"] = f"{len(changes)} capteur(s) synchronisé(s)"
+
+            elif action == "disable_specific":
+                entity_ids = frozenset((data or {}).get("entity_ids", []))
+                for item in all_items:
+                    if item.get("entity_id") in entity_ids and item.get("enabled"):
+                        item["enabled"] = False
+                        changes.append(
+                            {"entity_id": item.get("entity_id"), "action": "disabled", "reason": "user_request"}
+                        )
+                result["message"] = f"{len(changes)} capteur(s) désactivé(s)"
 
-                power_ids = {
-                    s.get("entity_id")
-                    for s in (power_data or [])
-                    if isinstance(s, dict) and s.get("entity_id")
-                }
+            else:
+                result["success"] = False
+                result["error"] = f"Action inconnue: {action}"
+                return result
 
-                result = {"success": True, "action": action, "changes": [], "errors": []}
-
-                if action == "disable_orphans":
-                    for _category, items in selection_data.items():
-                        if not isinstance(items, list):
-                            continue
-                        for item in items:
-                            if item.get("enabled") and item.get("entity_id") not in power_ids:
-                                item["enabled"] = False
-                                result["changes"].append(
-                                    {"entity_id": item.get("entity_id"), "action": "disabled", "reason": "orphan"}
-                                )
-                    result["message"] = f"{len(result['changes'])} capteur(s) orphelin(s) désactivé(s)"
-
-                elif action == "enable_available":
-                    for _category, items in selection_data.items():
-                        if not isinstance(items, list):
-                            continue
-                        for item in items:
-                            if (not item.get("enabled")) and item.get("entity_id") in power_ids:
-                                item["enabled"] = True
-                                result["changes"].append(
-                                    {"entity_id": item.get("entity_id"), "action": "enabled", "reason": "available"}
-                                )
-                    result["message"] = f"{len(result['changes'])} capteur(s) activé(s)"
-
-                elif action == "full_sync":
-                    for _category, items in selection_data.items():
-                        if not isinstance(items, list):
-                            continue
-                        for item in items:
-                            entity_id = item.get("entity_id")
-                            should_be_enabled = entity_id in power_ids
-                            if item.get("enabled", False) != should_be_enabled:
-                                item["enabled"] = should_be_enabled
-                                result["changes"].append(
-                                    {
-                                        "entity_id": entity_id,
-                                        "action": "enabled" if should_be_enabled else "disabled",
-                                        "reason": "sync",
-                                    }
-                                )
-                    result["message"] = f"{len(result['changes'])} capteur(s) synchronisé(s)"
-
-                elif action == "disable_specific":
-                    entity_ids = (data or {}).get("entity_ids", [])
-                    for _category, items in selection_data.items():
-                        if not isinstance(items, list):
-                            continue
-                        for item in items:
-                            if item.get("entity_id") in entity_ids and item.get("enabled"):
-                                item["enabled"] = False
-                                result["changes"].append(
-                                    {"entity_id": item.get("entity_id"), "action": "disabled", "reason": "user_request"}
-                                )
-                    result["message"] = f"{len(result['changes'])} capteur(s) désactivé(s)"
+            # Écriture atomique (tmp + os.replace) : jamais de fichier à moitié écrit
+            _write_bytes_atomic(_SELECTION_FILE, orjson.dumps(selection_data, option=_INDENT_OPTS))
+            _JSON_CACHE.pop(_SELECTION_FILE, None)
 
-                else:
-                    result["success"] = False
-                    result["error"] = f"Action inconnue: {action}"
-                    return result
+            return result
 
-                with open(selection_file, "w", encoding="utf-8") as f:
-                    json.dump(selection_data, f, indent=2, ensure_ascii=False)
+        async with _FILE_LOCKS[_SELECTION_FILE]:
+            pending = _PENDING_JSON_WRITES.get(_SELECTION_FILE)
 
-                return result
+            # Lectures indépendantes : les deux fichiers sont chargés en parallèle (executor).
+            # power_ids : lecture seule, servis depuis le cache tant que le fichier n'a pas bougé
+            selection_data, power_ids = await asyncio.gather(
+                self.hass.async_add_executor_job(_load_selection, pending),
+                self.hass.async_add_executor_job(_get_power_ids, _POWER_FILE),
+            )
 
-            result = await asyncio.get_event_loop().run_in_executor(None, _apply_action)
-            _LOGGER.info("[VALIDATION-ACTION] '%s': %s", action, result.get("message"))
-            return web.Response(
-        text=json.dumps({"error": False, "data": result}, default=_json_default),
-        content_type="application/json"
-    )
+            result = await self.hass.async_add_executor_job(_apply_action)
+            if result.get("success"):
+                # Le fichier écrit inclut l'écriture différée : elle n'a plus lieu d'être
+                _PENDING_JSON_WRITES.pop(_SELECTION_FILE, None)
+                _settle_json_waiters(_SELECTION_FILE)
 
-        except Exception as e:
-            _LOGGER.exception("[VALIDATION-ACTION] POST error: %s", e)
-            return web.Response(
-        text=json.dumps({"error": True, "message": str(e)}, default=_json_default),
-        content_type="application/json",
-        status=500
-    )
+        _LOGGER.info("[VALIDATION-ACTION] '%s': %s", action, result.get("message"))
+        return json_response({"error": False, "data": result})
 
 
 class HomeElecMigrationHelpersView(HomeAssistantView):
@@ -1070,38 +1769,27 @@ class HomeElecMigrationHelpersView(HomeAssistantView):
         self.export_service = ExportService(hass)
         _LOGGER.info("API Migration helpers initialisée")
 
+    @_api_handler("Erreur API Migration POST")
     async def post(self, request, action=None):
-        try:
-            if action is None:
-                action = request.match_info.get("action", "unknown")
+        if action is None:
+            action = request.match_info.get("action", "unknown")
 
-            data = await request.json()
-            _LOGGER.info("Migration POST /%s payload=%s", action, data)
-
-            if action == "create_helpers":
-                sensors = (data or {}).get("sensors") or []
-                cycles = (data or {}).get("cycles") or []
-                result = await self.export_service.create_helpers_auto(sensors, cycles)
-                return json_response(result)
-
-            if action == "validate":
-                helpers = (data or {}).get("helpers") or []
-                details = await self.export_service.validate_helpers(helpers)
-                valid = all(details.values()) if details else False
-                return web.Response(
-        text=json.dumps({"valid": valid, "details": details}, default=_json_default),
-        content_type="application/json"
-    )
+        data = await request.json()
+        _LOGGER.info("Migration POST /%s payload=%s", action, data)
 
-            return json_response({"success": False, "error": f"Action inconnue: {action}"}, status=404)
+        if action == "create_helpers":
+            sensors = (data or {}).get("sensors") or []
+            cycles = (data or {}).get("cycles") or []
+            result = await self.export_service.create_helpers_auto(sensors, cycles)
+            return json_response(result)
 
-        except Exception as e:
-            _LOGGER.exception("Erreur API Migration POST /%s: %s", action, e)
-            return web.Response(
-        text=json.dumps({"success": False, "error": str(e)}, default=_json_default),
-        content_type="application/json",
-        status=500
-    )
+        if action == "validate":
+            helpers = (data or {}).get("helpers") or []
+            details = await self.export_service.validate_helpers(helpers)
+            valid = all(details.values()) if details else False
+            return json_response({"valid": valid, "details": details})
+
+        return json_response({"success": False, "error": f"Action inconnue: {action}"}, status=404)
 
 
 class CacheClearView(HomeAssistantView):
@@ -1115,24 +1803,16 @@ class CacheClearView(HomeAssistantView):
     def __init__(self, hass: HomeAssistant):
         self.hass = hass
 
+    @_api_handler("[cache_clear] Erreur")
     async def post(self, request):
-        try:
-            cache = get_cache_manager()
-            count = cache.invalidate_all()
-
-            _LOGGER.info("[cache] Vidé : %s entrées", count)
+        cache = get_cache_manager()
+        count = cache.invalidate_all()
 
-            return json_response(
-                {"success": True, "message": f"Cache vidé ({count} entrées supprimées)", "cleared_entries": count}
-            )
+        _LOGGER.info("[cache] Vidé : %s entrées", count)
 
-        except Exception as e:
-            _LOGGER.exception("[cache_clear] Erreur: %s", e)
-            return web.Response(
-        text=json.dumps({"success": False, "error": str(e)}, default=_json_default),
-        content_type="application/json",
-        status=500
-    )
+        return json_response(
+            {"success": True, "message": f"Cache vidé ({count} entrées supprimées)", "cleared_entries": count}
+        )
 
 
 class CacheInvalidateEntityView(HomeAssistantView):
@@ -1146,33 +1826,18 @@ class CacheInvalidateEntityView(HomeAssistantView):
     def __init__(self, hass: HomeAssistant) -> None:
         self.hass = hass
 
+    @_api_handler("[cache_invalidate] Erreur")
     async def post(self, request):
-        try:
-            data = await request.json()
-            entity_id = (data or {}).get("entity_id")
-
-            if not entity_id:
-                return web.Response(
-        text=json.dumps({"success": False, "error": "entity_id manquant"}, default=_json_default),
-        content_type="application/json",
-        status=400
-    )
+        data = await request.json()
+        entity_id = (data or {}).get("entity_id")
 
-            cache = get_cache_manager()
-            cleared = cache.invalidate_entity(entity_id)
+        if not entity_id:
+            return json_response({"success": False, "error": "entity_id manquant"}, status=400)
 
-            return web.Response(
-        text=json.dumps({"success": True, "entity_id": entity_id, "cleared_entries": cleared}, default=_json_default),
-        content_type="application/json"
-    )
+        cache = get_cache_manager()
+        cleared = cache.invalidate_entity(entity_id)
 
-        except Exception as e:
-            _LOGGER.exception("[cache_invalidate] Erreur: %s", e)
-            return web.Response(
-        text=json.dumps({"success": False, "error": str(e)}, default=_json_default),
-        content_type="application/json",
-        status=500
-    )
+        return json_response({"success": True, "entity_id": entity_id, "cleared_entries": cleared})
 
 
 class EnableSensorView(HomeAssistantView):
@@ -1189,36 +1854,22 @@ class EnableSensorView(HomeAssistantView):
     def __init__(self, hass: HomeAssistant):
         self.hass = hass
     
+    @_api_handler("[enable_sensor] Erreur")
     async def post(self, request):
         """Active un capteur désactivé."""
-        try:
-            data = await request.json()
-            entity_id = (data or {}).get("entity_id")
-            
-            if not entity_id:
-                return web.Response(
-        text=json.dumps({"success": False, "error": "entity_id required"}, default=_json_default),
-        content_type="application/json",
-        status=400
-    )
-            
-            result = await enable_sensor_entity(self.hass, entity_id)
-            
-            if result["success"]:
-                return web.Response(
-        text=json.dumps({"error": False, "data": result}, default=_json_default),
-        content_type="application/json"
-    )
-            else:
-                return json_response(result, status=400)
-                
-        except Exception as e:
-            _LOGGER.exception("[enable_sensor] Erreur: %s", e)
-            return web.Response(
-        text=json.dumps({"success": False, "error": str(e)}, default=_json_default),
-        content_type="application/json",
-        status=500
-    )
+        data = await request.json()
+        entity_id = (data or {}).get("entity_id")
+        
+        if not entity_id:
+            return json_response({"success": False, "error": "entity_id required"}, status=400)
+        
+        result = await enable_sensor_entity(self.hass, entity_id)
+        
+        if result["success"]:
+            return json_response({"error": False, "data": result})
+        else:
+            return json_response(result, status=400)
+
     
 class HistoryAnalysisView(HomeAssistantView):
     """
@@ -1231,94 +1882,130 @@ class HistoryAnalysisView(HomeAssistantView):
     requires_auth = False
     cors_allowed = True
     
+    # Action -> méthode handler (GET : reçoit la requête, POST : reçoit le payload JSON)
+    _GET_HANDLERS = MappingProxyType({
+        "available_sensors": "_get_available_sensors",
+        "current_costs": "_get_current_costs",
+    })
+    _POST_HANDLERS = MappingProxyType({
+        "costs": "_fetch_history_costs",
+        "analysis": "_analyze_comparison",
+        "cost_analysis": "_analyze_cost_comparison",
+    })
+
     def __init__(self, hass: HomeAssistant):
         self.hass = hass
+        # Shortlist des capteurs coût daily HSE (invalidée à chaque modif du registry)
+        self._cost_daily_ids: Optional[list] = None
+        self._get_dispatch = _bind_handlers(self, self._GET_HANDLERS)
+        self._post_dispatch = _bind_handlers(self, self._POST_HANDLERS)
+        hass.bus.async_listen(er.EVENT_ENTITY_REGISTRY_UPDATED, self._on_entity_registry_updated)
         _LOGGER.info("🕒 API History Analysis initialisée")
+
+    @callback
+    def _on_entity_registry_updated(self, event: Event) -> None:
+        self._cost_daily_ids = None
+
+    def _get_cost_daily_ids(self) -> list:
+        """entity_ids des capteurs coût daily HSE (scan du registry seulement si invalidé)."""
+        if self._cost_daily_ids is None:
+            self._cost_daily_ids = [
+                entry.entity_id
+                for entry in _hse_registry_entries(self.hass)
+                if "_cout_daily" in entry.entity_id
+                and entry.entity_id.startswith("sensor.hse_")
+            ]
+        return self._cost_daily_ids
     
-    def _is_derived_from(self, entity_id: str, reference_id: str) -> bool:
-        """True si entity_id == reference_id OU si en remontant source_entity on tombe sur reference_id."""
+    def _is_derived_from(
+        self,
+        entity_id: str,
+        reference_id: str,
+        cache: Optional[Dict[str, bool]] = None,
+        states: Optional[Dict[str, Any]] = None,
+    ) -> bool:
+        """True si entity_id == reference_id OU si en remontant source_entity on tombe sur reference_id.
+
+        `cache` (optionnel, propre à un reference_id) mémorise le verdict de chaque maillon
+        parcouru : les chaînes partagées (même utility_meter parent) ne sont remontées qu'une fois.
+        `states` (optionnel) : snapshot entity_id -> State déjà construit par l'appelant.
+        """
         if not entity_id or not reference_id:
             return False
 
         visited = set()
         current = entity_id
+        result = False
 
         while current and current not in visited:
             if current == reference_id:
-                return True
+                result = True
+                break
+
+            if cache is not None and current in cache:
+                result = cache[current]
+                break
 
             visited.add(current)
-            st = self.hass.states.get(current)
+            st = states.get(current) if states is not None else self.hass.states.get(current)
             if not st:
-                return False
+                break
 
             attrs = st.attributes or {}
             parent = attrs.get("source_entity") or attrs.get("source_energy_entity")
             if not parent or parent == current:
-                return False
+                break
 
             current = parent
 
-        return False
+        if cache is not None:
+            for node in visited:
+                cache[node] = result
+        return result
 
     # === GET ===
     
+    @_api_handler("[HISTORY-API] Erreur GET", _error_message_payload)
     async def get(self, request, action=None):
         """GET /api/home_suivi_elec/history/{action}"""
-        try:
-            if action is None:
-                action = request.match_info.get("action", "unknown")
-            
-            _LOGGER.info(f"[HISTORY-API] GET /{action}")
-            
-            if action == "available_sensors":
-                return await self._get_available_sensors()
-
-            if action == "current_costs":
-                return await self._get_current_costs()
-            
-            if action == "test":
-                return self._success({"message": "History API opérationnelle"})
-            
-            return self._error(404, f"Action GET inconnue: {action}")
-            
-        except Exception as e:
-            _LOGGER.exception(f"[HISTORY-API] Erreur GET: {e}")
-            return self._error(500, str(e))
+        if action is None:
+            action = request.match_info.get("action", "unknown")
+        
+        _LOGGER.info("[HISTORY-API] GET /%s", action)
+        
+        handler = self._get_dispatch.get(action)
+        if handler is not None:
+            return await handler(request)
+        
+        if action == "test":
+            return self._success({"message": "History API opérationnelle"})
+        
+        return self._error(404, f"Action GET inconnue: {action}")
     
     # === POST ===
     
+    @_api_handler("[HISTORY-API] Erreur POST", _error_message_payload)
     async def post(self, request, action=None):
         """POST /api/home_suivi_elec/history/{action}"""
+        if action is None:
+            action = request.match_info.get("action", "unknown")
+        
         try:
-            if action is None:
-                action = request.match_info.get("action", "unknown")
-            
-            try:
-                data = await request.json()
-            except Exception as e:
-                return self._error(400, f"JSON invalide: {e}")
-            
-            _LOGGER.info(f"[HISTORY-API] POST /{action}")
-            
-            if action == "costs":
-                return await self._fetch_history_costs(data)
-            
-            if action == "analysis":
-                return await self._analyze_comparison(data)
-
-            if action == "cost_analysis":
-                return await self._analyze_cost_comparison(data)
-            
-            return self._error(404, f"Action POST inconnue: {action}")
-            
+            data = await request.json()
         except Exception as e:
-            _LOGGER.exception(f"[HISTORY-API] Erreur POST: {e}")
-            return self._error(500, str(e))
+            return self._error(400, f"JSON invalide: {e}")
+        
+        _LOGGER.info("[HISTORY-API] POST /%s", action)
+        
+        handler = self._post_dispatch.get(action)
+        if handler is not None:
+            return await handler(data)
+        
+        return self._error(404, f"Action POST inconnue: {action}")
     
     # === MÉTHODES INTERNES ===
     
-    async def _get_available_sensors(self):
+    async def _get_available_sensors(self, request):
         """Retourne les capteurs HSE energy disponibles pour l'analyse"""
         try:
             all_states = self.hass.states.async_all("sensor")
@@ -1337,18 +2024,18 @@ class HistoryAnalysisView(HomeAssistantView):
                         "unit": attrs.get("unit_of_measurement", "kWh")
                     })
             
-            _LOGGER.info(f"[HISTORY] {len(sensors)} capteurs disponibles")
+            _LOGGER.info("[HISTORY] %s capteurs disponibles", len(sensors))
             
-            return self._success({
+            return await self._success_stream(request, {
                 "sensors": sensors,
                 "count": len(sensors)
-            })
+            }, "sensors")
             
         except Exception as e:
-            _LOGGER.exception(f"[HISTORY] Erreur available_sensors: {e}")
+            _LOGGER.exception("[HISTORY] Erreur available_sensors: %s", e)
             return self._error(500, str(e))
     
-    async def _get_current_costs(self):
+    async def _get_current_costs(self, request):
         """
         GET /api/home_suivi_elec/history/current_costs
         Retourne l'état actuel des capteurs coût (temps réel).
@@ -1363,7 +2050,8 @@ class HistoryAnalysisView(HomeAssistantView):
         - Inclure le capteur de référence (compteur) séparément + calcul de l'écart (gap)
         """
         try:
-            from homeassistant.helpers import entity_registry as er
+            # Snapshot unique de la state machine pour toute la requête
+            states_by_id = {st.entity_id: st for st in self.hass.states.async_all()}
 
             # 🆕 Récupérer le capteur de référence depuis config_entries
             external_capteur = None
@@ -1376,23 +2064,18 @@ class HistoryAnalysisView(HomeAssistantView):
                         hse_entry.options.get("external_capteur")
                         or hse_entry.options.get("external_sensor")
                     )
-                    _LOGGER.info(f"[CURRENT-COSTS] Capteur de référence: {external_capteur}")
+                    _LOGGER.info("[CURRENT-COSTS] Capteur de référence: %s", external_capteur)
             except Exception as e:
-                _LOGGER.warning(f"[CURRENT-COSTS] Impossible de lire external_capteur: {e}")
+                _LOGGER.warning("[CURRENT-COSTS] Impossible de lire external_capteur: %s", e)
 
             # ✅ CORRECTION: pré-initialiser reference_sensor à partir de external_capteur
             # (même si aucun capteur coût "référence" n'est trouvé/retourné)
             reference_sensor = None
             if external_capteur:
-                ref_state = self.hass.states.get(external_capteur)
+                ref_state = states_by_id.get(external_capteur)
                 ref_attrs = (ref_state.attributes or {}) if ref_state else {}
 
-                ref_energy = 0.0
-                if ref_state and ref_state.state not in ("unknown", "unavailable"):
-                    try:
-                        ref_energy = float(ref_state.state)
-                    except (ValueError, TypeError):
-                        ref_energy = 0.0
+                ref_energy = _safe_float(ref_state.state) if ref_state else 0.0
 
                 reference_sensor = {
                     "entity_id": external_capteur,
@@ -1408,178 +2091,187 @@ class HistoryAnalysisView(HomeAssistantView):
                     "state": ref_state.state if ref_state else None,
                 }
 
-            entity_reg = er.async_get(self.hass)
-
             cost_sensors_map = {}  # Dict[source_entity_id, sensor_data] (SANS référence)
-            excluded_count = 0
-            excluded_reasons = {
-                "unavailable": 0,
-                "unknown": 0,
-                "zero_values": 0,
-                "source_unavailable": 0,
-                "duplicate_ht": 0,
-            }
+            derivation_cache: Dict[str, bool] = {}  # mémo _is_derived_from (cette requête)
+            # Compteurs d'exclusion (dict excluded_reasons construit une seule fois à la fin)
+            n_unavailable = n_zero = n_source_unavailable = n_duplicate_ht = 0
+
+            for entity_id in self._get_cost_daily_ids():
+                state = states_by_id.get(entity_id)
+                if not state:
+                    n_unavailable += 1
+                    continue
 
-            for entity_id, entry in entity_reg.entities.items():
-                if (
-                    entry.platform == "home_suivi_elec"
-                    and "_cout_daily" in entity_id
-                    and entity_id.startswith("sensor.hse_")
-                ):
-                    state = self.hass.states.get(entity_id)
-                    if not state:
-                        excluded_count += 1
-                        excluded_reasons["unavailable"] += 1
-                        continue
+                # ✅ FILTRAGE 1 : Exclure si state unavailable/unknown
+                if state.state in ("unavailable", "unknown", "none", None):
+                    n_unavailable += 1
+                    _LOGGER.debug("[CURRENT-COSTS] Exclus %s: state=%s", entity_id, state.state)
+                    continue
 
-                    # ✅ FILTRAGE 1 : Exclure si state unavailable/unknown
-                    if state.state in ("unavailable", "unknown", "none", None):
-                        excluded_count += 1
-                        excluded_reasons["unavailable"] += 1
-                        _LOGGER.debug(f"[CURRENT-COSTS] Exclus {entity_id}: state={state.state}")
-                        continue
+                ag = (state.attributes or {}).get
+                source_entity_id = ag("source_entity")
 
-                    attrs = state.attributes or {}
-                    source_entity_id = attrs.get("source_entity")
+                if not source_entity_id:
+                    _LOGGER.debug("[CURRENT-COSTS] Exclus %s: pas de source_entity", entity_id)
+                    continue
 
-                    if not source_entity_id:
-                        _LOGGER.debug(f"[CURRENT-COSTS] Exclus {entity_id}: pas de source_entity")
-                        continue
+                # ✅ FILTRAGE 2 : Vérifier l'état de la source d'énergie
+                source_state = states_by_id.get(source_entity_id)
+                if source_state and source_state.state in ("unavailable", "unknown"):
+                    n_source_unavailable += 1
+                    _LOGGER.debug(
+                        "[CURRENT-COSTS] Exclus %s: source %s unavailable",
+                        entity_id,
+                        source_entity_id,
+                    )
+                    continue
 
-                    # ✅ FILTRAGE 2 : Vérifier l'état de la source d'énergie
-                    source_state = self.hass.states.get(source_entity_id)
-                    if source_state and source_state.state in ("unavailable", "unknown"):
-                        excluded_count += 1
-                        excluded_reasons["source_unavailable"] += 1
-                        _LOGGER.debug(
-                            f"[CURRENT-COSTS] Exclus {entity_id}: source {source_entity_id} unavailable"
-                        )
-                        continue
+                # Récupérer l'énergie depuis la source
+                energy_kwh = _safe_float(source_state.state) if source_state else 0.0
 
-                    # Récupérer l'énergie depuis la source
-                    energy_kwh = 0.0
-                    if source_state and source_state.state not in ("unknown", "unavailable"):
-                        try:
-                            energy_kwh = float(source_state.state)
-                        except (ValueError, TypeError):
-                            pass
+                # 🆕 Détecter si c'est le capteur de référence
+                is_reference = bool(
+                    external_capteur
+                    and self._is_derived_from(
+                        source_entity_id, external_capteur, derivation_cache, states_by_id
+                    )
+                )
 
-                    # 🆕 Détecter si c'est le capteur de référence
-                    is_reference = bool(external_capteur and self._is_derived_from(source_entity_id, external_capteur))
 
+                # ✅ DÉTECTION DU TYPE DE CAPTEUR (TTC ou HT)
+                kind = _cost_variant(entity_id)
 
-                    # ✅ DÉTECTION DU TYPE DE CAPTEUR (TTC ou HT)
-                    is_ttc = "_ttc" in entity_id.lower()
-                    is_ht = "_ht" in entity_id.lower() and "_ttc" not in entity_id.lower()
+                # Lire la valeur du capteur
+                sensor_value = _safe_float(state.state)
 
-                    # Lire la valeur du capteur
-                    try:
-                        sensor_value = float(state.state) if state.state not in ("unknown", "unavailable") else 0.0
-                    except (ValueError, TypeError):
-                        sensor_value = 0.0
-
-                    # ✅ CALCUL INTELLIGENT TTC/HT selon le type de capteur
-                    if is_ttc:
-                        cost_ttc = sensor_value
-                        cost_ht = cost_ttc / 1.1 if cost_ttc > 0 else 0.0
-                        _LOGGER.debug(
-                            f"[CURRENT-COSTS] {entity_id} (TTC): {cost_ttc:.2f}€ TTC → {cost_ht:.2f}€ HT"
-                        )
-                    elif is_ht:
-                        cost_ht = sensor_value
-                        cost_ttc = cost_ht * 1.1 if cost_ht > 0 else 0.0
-                        _LOGGER.debug(
-                            f"[CURRENT-COSTS] {entity_id} (HT): {cost_ht:.2f}€ HT → {cost_ttc:.2f}€ TTC"
-                        )
-                    else:
-                        cost_ttc = sensor_value
-                        cost_ht = cost_ttc / 1.1 if cost_ttc > 0 else 0.0
-                        _LOGGER.warning(f"[CURRENT-COSTS] {entity_id} sans suffixe TTC/HT, suppose TTC")
-
-                    # ✅ FILTRAGE 3 : Exclure si coût=0 ET énergie=0
-                    if cost_ttc == 0.0 and energy_kwh == 0.0:
-                        excluded_count += 1
-                        excluded_reasons["zero_values"] += 1
-                        _LOGGER.debug(f"[CURRENT-COSTS] Exclus {entity_id}: coût=0 énergie=0")
-                        continue
+                # ✅ CALCUL INTELLIGENT TTC/HT selon le type de capteur
+                if kind == "ttc":
+                    cost_ttc = sensor_value
+                    cost_ht = cost_ttc * _INV_VAT if cost_ttc > 0 else 0.0
+                    _LOGGER.debug(
+                        "[CURRENT-COSTS] %s (TTC): %.2f€ TTC → %.2f€ HT",
+                        entity_id,
+                        cost_ttc,
+                        cost_ht,
+                    )
+                elif kind == "ht":
+                    cost_ht = sensor_value
+                    cost_ttc = cost_ht * _VAT if cost_ht > 0 else 0.0
+                    _LOGGER.debug(
+                        "[CURRENT-COSTS] %s (HT): %.2f€ HT → %.2f€ TTC",
+                        entity_id,
+                        cost_ht,
+                        cost_ttc,
+                    )
+                else:
+                    cost_ttc = sensor_value
+                    cost_ht = cost_ttc * _INV_VAT if cost_ttc > 0 else 0.0
+                    _LOGGER.warning("[CURRENT-COSTS] %s sans suffixe TTC/HT, suppose TTC", entity_id)
+
+                # ✅ FILTRAGE 3 : Exclure si coût=0 ET énergie=0
+                if cost_ttc == 0.0 and energy_kwh == 0.0:
+                    n_zero += 1
+                    _LOGGER.debug("[CURRENT-COSTS] Exclus %s: coût=0 énergie=0", entity_id)
+                    continue
 
-                    sensor_data = {
-                        "entity_id": entity_id,
-                        "friendly_name": attrs.get("friendly_name", entity_id),
-                        "cost_ttc": round(cost_ttc, 2),
-                        "cost_ht": round(cost_ht, 2),
-                        "energy_kwh": round(energy_kwh, 3),
-                        "unit": attrs.get("unit_of_measurement", "EUR"),
-                        "source_entity": source_entity_id,
-                        "cycle": "daily",
-                        "is_reference": is_reference,
-                        "reference_only": False,  # 🆕 (explicite)
-                    }
+                sensor_data = {
+                    "entity_id": entity_id,
+                    "friendly_name": ag("friendly_name", entity_id),
+                    "cost_ttc": round(cost_ttc, 2),
+                    "cost_ht": round(cost_ht, 2),
+                    "energy_kwh": round(energy_kwh, 3),
+                    "unit": ag("unit_of_measurement", "EUR"),
+                    "source_entity": source_entity_id,
+                    "cycle": "daily",
+                    "is_reference": is_reference,
+                    "reference_only": False,  # 🆕 (explicite)
+                }
 
-                    # 🆕 Séparer référence vs internes
-                    if is_reference:
-                        # ✅ CORRECTION: si on a déjà un placeholder reference_only, on le remplace
-                        if reference_sensor is not None and reference_sensor.get("reference_only"):
-                            reference_sensor = sensor_data
-                            _LOGGER.info(
-                                f"[CURRENT-COSTS] Référence (placeholder→capteur coût): {entity_id} = {cost_ttc:.2f}€"
-                            )
-                            continue
+                # 🆕 Séparer référence vs internes
+                if is_reference:
+                    # ✅ CORRECTION: si on a déjà un placeholder reference_only, on le remplace
+                    if reference_sensor is not None and reference_sensor.get("reference_only"):
+                        reference_sensor = sensor_data
+                        _LOGGER.info(
+                            "[CURRENT-COSTS] Référence (placeholder→capteur coût): %s = %.2f€",
+                            entity_id,
+                            cost_ttc,
+                        )
+                        continue
 
-                        if reference_sensor is None:
-                            reference_sensor = sensor_data
-                            _LOGGER.info(
-                                f"[CURRENT-COSTS] Référence détectée: {entity_id} = {cost_ttc:.2f}€"
-                            )
-                        else:
-                            # Dédup sur la référence aussi (priorité TTC > HT)
-                            existing_is_ttc = "_ttc" in reference_sensor["entity_id"].lower()
-                            if is_ttc and not existing_is_ttc:
-                                _LOGGER.info(
-                                    f"[CURRENT-COSTS] Référence: remplacement {reference_sensor['entity_id']} (HT) "
-                                    f"par {entity_id} (TTC)"
-                                )
-                                reference_sensor = sensor_data
-                            elif is_ht and existing_is_ttc:
-                                excluded_count += 1
-                                excluded_reasons["duplicate_ht"] += 1
-                                _LOGGER.debug(
-                                    f"[CURRENT-COSTS] Référence: exclusion {entity_id} (HT) "
-                                    f"doublon de {reference_sensor['entity_id']} (TTC)"
-                                )
-                            else:
-                                _LOGGER.warning(
-                                    f"[CURRENT-COSTS] Référence: doublon ambigu "
-                                    f"{reference_sensor['entity_id']} vs {entity_id}"
-                                )
-                        continue  # ⚠️ Ne pas mettre la référence dans cost_sensors_map
-
-                    # ✅ DÉDUPLICATION : Gérer les doublons TTC/HT pour la même source (internes)
-                    if source_entity_id in cost_sensors_map:
-                        existing = cost_sensors_map[source_entity_id]
-                        existing_is_ttc = "_ttc" in existing["entity_id"].lower()
-
-                        if is_ttc and not existing_is_ttc:
+                    if reference_sensor is None:
+                        reference_sensor = sensor_data
+                        _LOGGER.info(
+                            "[CURRENT-COSTS] Référence détectée: %s = %.2f€",
+                            entity_id,
+                            cost_ttc,
+                        )
+                    else:
+                        # Dédup sur la référence aussi (priorité TTC > HT)
+                        # Variante relue depuis l'entity_id (pas de champ interne dans la réponse)
+                        existing_is_ttc = _cost_variant(reference_sensor["entity_id"]) == "ttc"
+                        if kind == "ttc" and not existing_is_ttc:
                             _LOGGER.info(
-                                f"[CURRENT-COSTS] Remplacement {existing['entity_id']} (HT) "
-                                f"par {entity_id} (TTC) pour source {source_entity_id}"
+                                "[CURRENT-COSTS] Référence: remplacement %s (HT) "
+                                "par %s (TTC)",
+                                reference_sensor["entity_id"],
+                                entity_id,
                             )
-                        elif is_ht and existing_is_ttc:
-                            excluded_count += 1
-                            excluded_reasons["duplicate_ht"] += 1
+                            # Mêmes clés : mise à jour en place (identité conservée)
+                            reference_sensor.update(sensor_data)
+                        elif kind == "ht" and existing_is_ttc:
+                            n_duplicate_ht += 1
                             _LOGGER.debug(
-                                f"[CURRENT-COSTS] Exclus {entity_id} (HT): "
-                                f"doublon de {existing['entity_id']} (TTC)"
+                                "[CURRENT-COSTS] Référence: exclusion %s (HT) "
+                                "doublon de %s (TTC)",
+                                entity_id,
+                                reference_sensor["entity_id"],
                             )
-                            continue
                         else:
                             _LOGGER.warning(
-                                f"[CURRENT-COSTS] Doublon ambigu pour {source_entity_id}: "
-                                f"{existing['entity_id']} vs {entity_id}"
+                                "[CURRENT-COSTS] Référence: doublon ambigu "
+                                "%s vs %s",
+                                reference_sensor["entity_id"],
+                                entity_id,
                             )
-                            continue
+                    continue  # ⚠️ Ne pas mettre la référence dans cost_sensors_map
+
+                # ✅ DÉDUPLICATION : Gérer les doublons TTC/HT pour la même source (internes)
+                if source_entity_id in cost_sensors_map:
+                    existing = cost_sensors_map[source_entity_id]
+                    existing_is_ttc = _cost_variant(existing["entity_id"]) == "ttc"
+
+                    if kind == "ttc" and not existing_is_ttc:
+                        _LOGGER.info(
+                            "[CURRENT-COSTS] Remplacement %s (HT) "
+                            "par %s (TTC) pour source %s",
+                            existing["entity_id"],
+                            entity_id,
+                            source_entity_id,
+                        )
+                        # Mêmes clés : mise à jour en place (identité conservée)
+                        existing.update(sensor_data)
+                        continue
+                    elif kind == "ht" and existing_is_ttc:
+                        n_duplicate_ht += 1
+                        _LOGGER.debug(
+                            "[CURRENT-COSTS] Exclus %s (HT): "
+                            "doublon de %s (TTC)",
+                            entity_id,
+                            existing["entity_id"],
+                        )
+                        continue
+                    else:
+                        _LOGGER.warning(
+                            "[CURRENT-COSTS] Doublon ambigu pour %s: "
+                            "%s vs %s",
+                            source_entity_id,
+                            existing["entity_id"],
+                            entity_id,
+                        )
+                        continue
 
-                    cost_sensors_map[source_entity_id] = sensor_data
+                cost_sensors_map[source_entity_id] = sensor_data
 
             # Convertir en liste (sans le capteur de référence)
             cost_sensors = list(cost_sensors_map.values())
@@ -1588,10 +2280,12 @@ class HistoryAnalysisView(HomeAssistantView):
             top_10 = cost_sensors[:10]
             other_sensors = cost_sensors[10:]
 
-            # Totaux (SANS référence)
-            total_cost_ttc = sum(s["cost_ttc"] for s in cost_sensors)
-            total_cost_ht = sum(s["cost_ht"] for s in cost_sensors)
-            total_energy = sum(s["energy_kwh"] for s in cost_sensors)
+            # Totaux (SANS référence) : une seule passe pour les trois cumuls
+            total_cost_ttc = total_cost_ht = total_energy = 0.0
+            for s in cost_sensors:
+                total_cost_ttc += s["cost_ttc"]
+                total_cost_ht += s["cost_ht"]
+                total_energy += s["energy_kwh"]
 
             # 🆕 Calculer l'écart vs référence
             gap_info = None
@@ -1613,20 +2307,41 @@ class HistoryAnalysisView(HomeAssistantView):
                 }
 
                 _LOGGER.info(
-                    f"[CURRENT-COSTS] Écart détecté: {gap_energy:.3f} kWh ({gap_pct:.1f}%) = {gap_cost_ttc:.2f}€ TTC"
+                    "[CURRENT-COSTS] Écart détecté: %.3f kWh (%.1f%%) = %.2f€ TTC",
+                    gap_energy,
+                    gap_pct,
+                    gap_cost_ttc,
                 )
 
+            excluded_count = n_unavailable + n_zero + n_source_unavailable + n_duplicate_ht
+            excluded_reasons = {
+                "unavailable": n_unavailable,
+                "unknown": 0,
+                "zero_values": n_zero,
+                "source_unavailable": n_source_unavailable,
+                "duplicate_ht": n_duplicate_ht,
+            }
+
             _LOGGER.info(
-                f"[CURRENT-COSTS] ✅ {len(cost_sensors)} capteurs uniques, "
-                f"{excluded_count} exclus "
-                f"(unavailable:{excluded_reasons['unavailable']}, "
-                f"zero:{excluded_reasons['zero_values']}, "
-                f"source_unavailable:{excluded_reasons['source_unavailable']}, "
-                f"duplicate_ht:{excluded_reasons['duplicate_ht']}), "
-                f"total={total_cost_ttc:.2f}€ TTC / {total_cost_ht:.2f}€ HT"
+                "[CURRENT-COSTS] ✅ %s capteurs uniques, "
+                "%s exclus "
+                "(unavailable:%s, "
+                "zero:%s, "
+                "source_unavailable:%s, "
+                "duplicate_ht:%s), "
+                "total=%.2f€ TTC / %.2f€ HT",
+                len(cost_sensors),
+                excluded_count,
+                n_unavailable,
+                n_zero,
+                n_source_unavailable,
+                n_duplicate_ht,
+                total_cost_ttc,
+                total_cost_ht,
             )
 
-            return self._success(
+            return await self._success_stream(
+                request,
                 {
                     "reference_sensor": reference_sensor,
                     "top_10": top_10,
@@ -1639,13 +2354,15 @@ class HistoryAnalysisView(HomeAssistantView):
                     "excluded_count": excluded_count,
                     "excluded_reasons": excluded_reasons,
                     "timestamp": self._get_timestamp(),
-                }
+                },
+                "other_sensors",
             )
 
         except Exception as e:
-            _LOGGER.exception(f"[CURRENT-COSTS] Erreur: {e}")
+            _LOGGER.exception("[CURRENT-COSTS] Erreur: %s", e)
             return self._error(500, str(e))
 
+    @_api_handler("[COST-ANALYSIS] Erreur", _error_message_payload)
     async def _analyze_cost_comparison(self, data):
         """
         POST /api/home_suivi_elec/history/cost_analysis
@@ -1660,626 +2377,519 @@ class HistoryAnalysisView(HomeAssistantView):
         - Gestion d’un capteur de référence (compteur) via config_entries options["external_capteur"]
         - Le capteur de référence est renvoyé séparément et EXCLU des totaux / tops
         """
-        try:
-            from homeassistant.components.recorder.statistics import statistics_during_period
-            from homeassistant.helpers import entity_registry as er
-            from ..history_analytics import _to_datetime
-
-            # ═══════════════════════════════════════════════════════════
-            # 1. Parse et valide les paramètres
-            # ═══════════════════════════════════════════════════════════
-            baseline_start = data.get("baseline_start")
-            baseline_end = data.get("baseline_end")
-            event_start = data.get("event_start")
-            event_end = data.get("event_end")
-            top_limit = int(data.get("top_limit", 10))
-            sort_by = data.get("sort_by", "cost_ttc")
-
-            if not all([baseline_start, baseline_end, event_start, event_end]):
-                return self._error(
-                    400,
-                    "Paramètres baseline_start, baseline_end, event_start, event_end requis",
-                )
-
-            # Convertir les timestamps en datetime
-            try:
-                baseline_start_dt = _to_datetime(baseline_start)
-                baseline_end_dt = _to_datetime(baseline_end)
-                event_start_dt = _to_datetime(event_start)
-                event_end_dt = _to_datetime(event_end)
-            except Exception as e:
-                return self._error(400, f"Format de date invalide: {e}")
-
-            _LOGGER.info(
-                f"[COST-ANALYSIS] baseline: {baseline_start_dt.isoformat()} → {baseline_end_dt.isoformat()}"
+        from homeassistant.components.recorder.statistics import statistics_during_period
+        from ..history_analytics import _to_datetime
+
+        # ═══════════════════════════════════════════════════════════
+        # 1. Parse et valide les paramètres
+        # ═══════════════════════════════════════════════════════════
+        baseline_start = data.get("baseline_start")
+        baseline_end = data.get("baseline_end")
+        event_start = data.get("event_start")
+        event_end = data.get("event_end")
+        top_limit = int(data.get("top_limit", 10))
+        sort_by = data.get("sort_by", "cost_ttc")
+
+        if not all([baseline_start, baseline_end, event_start, event_end]):
+            return self._error(
+                400,
+                "Paramètres baseline_start, baseline_end, event_start, event_end requis",
             )
-            _LOGGER.info(
-                f"[COST-ANALYSIS] event: {event_start_dt.isoformat()} → {event_end_dt.isoformat()}"
-            )
-
-            # ═══════════════════════════════════════════════════════════
-            # 🆕 RÉCUPÉRER LE CAPTEUR DE RÉFÉRENCE depuis config_entries
-            # ═══════════════════════════════════════════════════════════
-            external_capteur = None
-            try:
-                config_entries = self.hass.config_entries.async_entries(DOMAIN)
-                if config_entries:
-                    hse_entry = config_entries[0]  # Normalement une seule entry
-                    external_capteur = (
-                        hse_entry.options.get("external_capteur")
-                        or hse_entry.options.get("external_sensor")
-                    )
-                    _LOGGER.info(f"[COST-ANALYSIS] Capteur de référence: {external_capteur}")
-            except Exception as e:
-                _LOGGER.warning(f"[COST-ANALYSIS] Impossible de lire external_capteur: {e}")
-
-            # ═══════════════════════════════════════════════════════════
-            # 2. Récupérer tous les capteurs de COÛT HSE avec leur source
-            # (conservé tel quel, même si redondant avec sensors_map)
-            # ═══════════════════════════════════════════════════════════
-            entity_reg = er.async_get(self.hass)
-            sensors_by_source = {}
-
-            for entity_id, entry in entity_reg.entities.items():
-                if (
-                    entry.platform == "home_suivi_elec"
-                    and entity_id.startswith("sensor.hse_")
-                    and "_cout_daily" in entity_id
-                ):
-                    state = self.hass.states.get(entity_id)
-                    if not state or state.state in ("unavailable", "unknown", "none", None):
-                        continue
-
-                    attrs = state.attributes or {}
-                    source_entity = attrs.get("source_entity")
-
-                    if not source_entity:
-                        _LOGGER.debug(
-                            f"[COST-ANALYSIS] Capteur {entity_id} sans source_entity, ignoré"
-                        )
-                        continue
-
-                    is_ttc = "_ttc" in entity_id.lower()
-                    is_ht = "_ht" in entity_id.lower() and "_ttc" not in entity_id.lower()
-
-                    if not is_ht and not is_ttc:
-                        _LOGGER.warning(
-                            f"[COST-ANALYSIS] Capteur {entity_id} sans suffixe HT/TTC, supposé TTC"
-                        )
-                        is_ttc = True
 
-                    variant = "ttc" if is_ttc else "ht"
-                    statistic_id = attrs.get("statistic_id") or entity_id
-                    price_per_kwh = float(attrs.get("price_per_kwh", 0.0))
-
-                    sensor_info = {
-                        "entity_id": entity_id,
-                        "source_entity": source_entity,
-                        "friendly_name": attrs.get("friendly_name", entity_id),
-                        "statistic_id": statistic_id,
-                        "variant": variant,
-                        "price_per_kwh": price_per_kwh,
-                        "cycle": attrs.get("cycle", "daily"),
-                    }
+        # Convertir les timestamps en datetime
+        try:
+            baseline_start_dt = _to_datetime(baseline_start)
+            baseline_end_dt = _to_datetime(baseline_end)
+            event_start_dt = _to_datetime(event_start)
+            event_end_dt = _to_datetime(event_end)
+        except Exception as e:
+            return self._error(400, f"Format de date invalide: {e}")
 
-                    if source_entity not in sensors_by_source:
-                        sensors_by_source[source_entity] = {}
+        _LOGGER.info(
+            "[COST-ANALYSIS] baseline: %s → %s",
+            baseline_start_dt.isoformat(),
+            baseline_end_dt.isoformat(),
+        )
+        _LOGGER.info(
+            "[COST-ANALYSIS] event: %s → %s",
+            event_start_dt.isoformat(),
+            event_end_dt.isoformat(),
+        )
 
-                    sensors_by_source[source_entity][variant] = sensor_info
+        # ═══════════════════════════════════════════════════════════
+        # 🆕 RÉCUPÉRER LE CAPTEUR DE RÉFÉRENCE depuis config_entries
+        # ═══════════════════════════════════════════════════════════
+        external_capteur = None
+        try:
+            config_entries = self.hass.config_entries.async_entries(DOMAIN)
+            if config_entries:
+                hse_entry = config_entries[0]  # Normalement une seule entry
+                external_capteur = (
+                    hse_entry.options.get("external_capteur")
+                    or hse_entry.options.get("external_sensor")
+                )
+                _LOGGER.info("[COST-ANALYSIS] Capteur de référence: %s", external_capteur)
+        except Exception as e:
+            _LOGGER.warning("[COST-ANALYSIS] Impossible de lire external_capteur: %s", e)
 
-            _LOGGER.info(
-                f"[COST-ANALYSIS] {len(sensors_by_source)} sources avec capteurs coût trouvées"
+        # Réponse vide cohérente
+        def _empty_result():
+            return self._success(
+                {
+                    "baseline_period": {
+                        "start": baseline_start,
+                        "end": baseline_end,
+                        "total_kwh": 0.0,
+                        "total_cost_ht": 0.0,
+                        "total_cost_ttc": 0.0,
+                        "sensor_count": 0,
+                    },
+                    "event_period": {
+                        "start": event_start,
+                        "end": event_end,
+                        "total_kwh": 0.0,
+                        "total_cost_ht": 0.0,
+                        "total_cost_ttc": 0.0,
+                        "sensor_count": 0,
+                    },
+                    "total_comparison": {
+                        "delta_kwh": 0.0,
+                        "delta_cost_ht": 0.0,
+                        "delta_cost_ttc": 0.0,
+                        "delta_pct_kwh": 0.0,
+                        "delta_pct_cost": 0.0,
+                        "trend": "stable",
+                    },
+                    "reference_sensor": None,
+                    "top_variations": [],
+                    "top_consumers": [],
+                    "other_sensors": [],
+                    "timestamp": self._get_timestamp(),
+                }
             )
 
-            # Réponse vide cohérente
-            def _empty_result():
-                return self._success(
-                    {
-                        "baseline_period": {
-                            "start": baseline_start,
-                            "end": baseline_end,
-                            "total_kwh": 0.0,
-                            "total_cost_ht": 0.0,
-                            "total_cost_ttc": 0.0,
-                            "sensor_count": 0,
-                        },
-                        "event_period": {
-                            "start": event_start,
-                            "end": event_end,
-                            "total_kwh": 0.0,
-                            "total_cost_ht": 0.0,
-                            "total_cost_ttc": 0.0,
-                            "sensor_count": 0,
-                        },
-                        "total_comparison": {
-                            "delta_kwh": 0.0,
-                            "delta_cost_ht": 0.0,
-                            "delta_cost_ttc": 0.0,
-                            "delta_pct_kwh": 0.0,
-                            "delta_pct_cost": 0.0,
-                            "trend": "stable",
-                        },
-                        "reference_sensor": None,
-                        "top_variations": [],
-                        "top_consumers": [],
-                        "other_sensors": [],
-                        "timestamp": self._get_timestamp(),
-                    }
+        # ═══════════════════════════════════════════════════════════
+        # 2. Récupérer les capteurs de COÛT HSE (liste registry mise en cache)
+        #    regroupés par source, avec prix HT/TTC et flag is_reference
+        # ═══════════════════════════════════════════════════════════
+        # Snapshot unique des états : lecture cohérente entre détection référence et prix
+        states_by_id = {st.entity_id: st for st in self.hass.states.async_all()}
+        states_get = states_by_id.get
+        sensors_map = {}
+        # Verdicts de dérivation partagés entre les variants HT/TTC d'une même source
+        derivation_cache: Dict[str, bool] = {}
+
+        for entity_id in self._get_cost_daily_ids():
+            state = states_get(entity_id)
+            if not state or state.state in ("unavailable", "unknown", "none", None):
+                continue
+
+            ag = (state.attributes or {}).get
+            source_entity = ag("source_entity")
+
+            if not source_entity:
+                _LOGGER.debug(
+                    "[COST-ANALYSIS] Capteur %s sans source_entity, ignoré",
+                    entity_id,
                 )
+                continue
+
+            # 🆕 Détecter si c'est le capteur de référence
+            # ✅ FIX: utiliser la variable existante dans ce scope (source_entity)
+            is_reference = bool(
+                external_capteur
+                and self._is_derived_from(
+                    source_entity, external_capteur, derivation_cache, states_by_id
+                )
+            )
 
-            if not sensors_by_source:
-                return _empty_result()
-
-            # ═══════════════════════════════════════════════════════════
-            # 3. Récupérer les capteurs avec flag is_reference
-            # ═══════════════════════════════════════════════════════════
-            entity_reg = er.async_get(self.hass)
-            sensors_map = {}
-
-            for entity_id, entry in entity_reg.entities.items():
-                if (
-                    entry.platform == "home_suivi_elec"
-                    and entity_id.startswith("sensor.hse_")
-                    and "_cout_daily" in entity_id
-                ):
-                    state = self.hass.states.get(entity_id)
-                    if not state or state.state in ("unavailable", "unknown", "none", None):
-                        continue
-
-                    attrs = state.attributes or {}
-                    source_entity = attrs.get("source_entity")
-
-                    if not source_entity:
-                        continue
-
-                    # 🆕 Détecter si c'est le capteur de référence
-                    # ✅ FIX: utiliser la variable existante dans ce scope (source_entity)
-                    is_reference = bool(
-                        external_capteur and self._is_derived_from(source_entity, external_capteur)
-                    )
-
-                    # Détecter si HT ou TTC
-                    is_ttc = "_ttc" in entity_id.lower()
-                    is_ht = "_ht" in entity_id.lower() and "_ttc" not in entity_id.lower()
-
-                    if not is_ht and not is_ttc:
-                        is_ttc = True  # Par défaut
-
-                    price_per_kwh = float(attrs.get("price_per_kwh", 0.0))
-
-                    if source_entity not in sensors_map:
-                        # Friendly name depuis la source d'énergie
-                        source_state = self.hass.states.get(source_entity)
-                        source_attrs = source_state.attributes or {} if source_state else {}
-
-                        sensors_map[source_entity] = {
-                            "source_entity": source_entity,
-                            "friendly_name": source_attrs.get("friendly_name", source_entity),
-                            "statistic_id": source_attrs.get("statistic_id") or source_entity,
-                            "prix_ht": None,
-                            "prix_ttc": None,
-                            "is_reference": is_reference,  # 🆕 Flag référence
-                        }
-                    else:
-                        # ✅ Cohérence: si déjà créé, on force le flag à True si l'un des variants est référence
-                        if is_reference:
-                            sensors_map[source_entity]["is_reference"] = True
-
-                    if is_ttc:
-                        sensors_map[source_entity]["prix_ttc"] = price_per_kwh
-                    else:
-                        sensors_map[source_entity]["prix_ht"] = price_per_kwh
+            # Détecter si HT ou TTC (TTC par défaut sans suffixe)
+            variant = _cost_variant(entity_id)
+            if variant is None:
+                _LOGGER.warning(
+                    "[COST-ANALYSIS] Capteur %s sans suffixe HT/TTC, supposé TTC",
+                    entity_id,
+                )
+            is_ttc = variant != "ht"
 
-            # Compléter les prix manquants avec ratio 1.1
-            for _source_entity, info in sensors_map.items():
-                if info["prix_ttc"] and not info["prix_ht"]:
-                    info["prix_ht"] = info["prix_ttc"] / 1.1
-                elif info["prix_ht"] and not info["prix_ttc"]:
-                    info["prix_ttc"] = info["prix_ht"] * 1.1
+            price_per_kwh = float(ag("price_per_kwh", 0.0))
 
-            _LOGGER.info(
-                f"[COST-ANALYSIS] {len(sensors_map)} sources d'énergie avec pricing trouvées"
-            )
+            if source_entity not in sensors_map:
+                # Friendly name depuis la source d'énergie
+                source_state = states_get(source_entity)
+                sag = (source_state.attributes or {} if source_state else {}).get
 
-            if not sensors_map:
-                return _empty_result()
+                sensors_map[source_entity] = {
+                    "source_entity": source_entity,
+                    "friendly_name": sag("friendly_name", source_entity),
+                    "statistic_id": sag("statistic_id") or source_entity,
+                    "prix_ht": None,
+                    "prix_ttc": None,
+                    "is_reference": is_reference,  # 🆕 Flag référence
+                }
+            else:
+                # ✅ Cohérence: si déjà créé, on force le flag à True si l'un des variants est référence
+                if is_reference:
+                    sensors_map[source_entity]["is_reference"] = True
 
-            # ═══════════════════════════════════════════════════════════
-            # 4. Récupérer les statistiques ÉNERGIE (pas coût)
-            # ═══════════════════════════════════════════════════════════
-            statistic_ids = [info["statistic_id"] for info in sensors_map.values()]
+            if is_ttc:
+                sensors_map[source_entity]["prix_ttc"] = price_per_kwh
+            else:
+                sensors_map[source_entity]["prix_ht"] = price_per_kwh
+
+        # Compléter les prix manquants avec le ratio TVA (_VAT)
+        for _source_entity, info in sensors_map.items():
+            if info["prix_ttc"] and not info["prix_ht"]:
+                info["prix_ht"] = info["prix_ttc"] * _INV_VAT
+            elif info["prix_ht"] and not info["prix_ttc"]:
+                info["prix_ttc"] = info["prix_ht"] * _VAT
+
+        _LOGGER.info(
+            "[COST-ANALYSIS] %s sources d'énergie avec pricing trouvées",
+            len(sensors_map),
+        )
 
-            _LOGGER.info(
-                f"[COST-ANALYSIS] Fetching energy statistics pour {len(statistic_ids)} sources"
-            )
+        if not sensors_map:
+            return _empty_result()
+
+        reference_sources = {
+            src for src, info in sensors_map.items() if info["is_reference"]
+        }
+        # Lignes figées pour la boucle arithmétique : seuls les champs lus y sont copiés
+        source_rows = [
+            (src, info["statistic_id"], info["prix_ht"], info["prix_ttc"], info["friendly_name"])
+            for src, info in sensors_map.items()
+        ]
+
+        # ═══════════════════════════════════════════════════════════
+        # 3. Récupérer les statistiques ÉNERGIE (pas coût)
+        # ═══════════════════════════════════════════════════════════
+        statistic_ids = [row[1] for row in source_rows]
+
+        _LOGGER.info(
+            "[COST-ANALYSIS] Fetching energy statistics pour %s sources",
+            len(statistic_ids),
+        )
 
-            baseline_stats = await self.hass.async_add_executor_job(
+        def _fetch_stats(start_dt, end_dt):
+            return self.hass.async_add_executor_job(
                 statistics_during_period,
                 self.hass,
-                baseline_start_dt,
-                baseline_end_dt,
+                start_dt,
+                end_dt,
                 statistic_ids,
                 "hour",
                 None,
                 {"sum"},
             )
 
-            event_stats = await self.hass.async_add_executor_job(
-                statistics_during_period,
-                self.hass,
-                event_start_dt,
-                event_end_dt,
-                statistic_ids,
-                "hour",
-                None,
-                {"sum"},
+        # Périodes proches : une seule requête recorder sur l'union, découpée ensuite.
+        # Seuil relatif : écart <= plus courte des deux périodes, soit au plus 1,5x les
+        # lignes des deux requêtes séparées (chevauchement : gap négatif, union plus petite)
+        gap = max(event_start_dt, baseline_start_dt) - min(event_end_dt, baseline_end_dt)
+        if gap <= min(baseline_end_dt - baseline_start_dt, event_end_dt - event_start_dt):
+            all_stats = await _fetch_stats(
+                min(baseline_start_dt, event_start_dt),
+                max(baseline_end_dt, event_end_dt),
             )
+            baseline_stats = _slice_stats(all_stats, baseline_start_dt, baseline_end_dt)
+            event_stats = _slice_stats(all_stats, event_start_dt, event_end_dt)
+        else:
+            baseline_stats = await _fetch_stats(baseline_start_dt, baseline_end_dt)
+            event_stats = await _fetch_stats(event_start_dt, event_end_dt)
+
+        # ═══════════════════════════════════════════════════════════
+        # 4. Calculer les coûts depuis l'énergie + prix
+        # ═══════════════════════════════════════════════════════════
+        # Le capteur de référence est séparé des autres dès la construction
+        reference_comparison = None
+        internal_comparisons = []
+        # Totaux (SANS le capteur de référence), cumulés au fil de la boucle
+        total_baseline_kwh = total_baseline_cost_ht = total_baseline_cost_ttc = 0.0
+        total_event_kwh = total_event_cost_ht = total_event_cost_ttc = 0.0
+        skipped_zero = 0
+        baseline_duration_s = (baseline_end_dt - baseline_start_dt).total_seconds()
+        event_duration_s = (event_end_dt - event_start_dt).total_seconds()
+        baseline_h = baseline_duration_s / 3600.0 if baseline_duration_s > 0 else 0.0
+        event_h = event_duration_s / 3600.0 if event_duration_s > 0 else 0.0
+        baseline_d = baseline_duration_s / 86400.0 if baseline_duration_s > 0 else 0.0
+        event_d = event_duration_s / 86400.0 if event_duration_s > 0 else 0.0
+
+        for source_entity, statistic_id, prix_ht, prix_ttc, friendly_name in source_rows:
+
+            # === BASELINE ===
+            baseline_rows = baseline_stats.get(statistic_id, [])
+            if not baseline_rows:
+                _LOGGER.debug("[COST-ANALYSIS] Pas de stats baseline pour %s", statistic_id)
+                continue
+
+            # === EVENT ===
+            event_rows = event_stats.get(statistic_id, [])
+            if not event_rows:
+                _LOGGER.debug("[COST-ANALYSIS] Pas de stats event pour %s", statistic_id)
+                continue
+
+            baseline_energy_kwh = _rows_energy(baseline_rows)
+            event_energy_kwh = _rows_energy(event_rows)
+
+            # Source sans consommation sur les deux périodes : aucun coût ni taux à calculer
+            if baseline_energy_kwh == 0.0 and event_energy_kwh == 0.0:
+                skipped_zero += 1
+                continue
+
+            baseline_cost_ht = baseline_energy_kwh * prix_ht if prix_ht else 0.0
+            baseline_cost_ttc = baseline_energy_kwh * prix_ttc if prix_ttc else 0.0
+            event_cost_ht = event_energy_kwh * prix_ht if prix_ht else 0.0
+            event_cost_ttc = event_energy_kwh * prix_ttc if prix_ttc else 0.0
+
+            (
+                baseline_kwh_h, baseline_cost_ttc_h, baseline_kwh_d, baseline_cost_ttc_d
+            ) = _period_rates(baseline_energy_kwh, baseline_cost_ttc, baseline_h, baseline_d)
+            (
+                event_kwh_h, event_cost_ttc_h, event_kwh_d, event_cost_ttc_d
+            ) = _period_rates(event_energy_kwh, event_cost_ttc, event_h, event_d)
+
+            delta_energy = event_energy_kwh - baseline_energy_kwh
+            delta_cost_ht = event_cost_ht - baseline_cost_ht
+            delta_cost_ttc = event_cost_ttc - baseline_cost_ttc
+
+            pct_energy = _safe_div(delta_energy, baseline_energy_kwh, 1) * 100
+            pct_cost_ttc = _safe_div(delta_cost_ttc, baseline_cost_ttc, 1) * 100
+
+            comparison = {
+                "entity_id": source_entity,
+                "display_name": friendly_name,
+                "source_entity": source_entity,
+                # Baseline
+                "baseline_energy_kwh": round(baseline_energy_kwh, 3),
+                "baseline_cost_ht": round(baseline_cost_ht, 2),
+                "baseline_cost_ttc": round(baseline_cost_ttc, 2),
+                "baseline_energy_kwh_per_hour": baseline_kwh_h,
+                "baseline_cost_ttc_per_hour": baseline_cost_ttc_h,
+                "baseline_energy_kwh_per_day": baseline_kwh_d,
+                "baseline_cost_ttc_per_day": baseline_cost_ttc_d,
+                # Event
+                "event_energy_kwh": round(event_energy_kwh, 3),
+                "event_cost_ht": round(event_cost_ht, 2),
+                "event_cost_ttc": round(event_cost_ttc, 2),
+                "event_energy_kwh_per_hour": event_kwh_h,
+                "event_cost_ttc_per_hour": event_cost_ttc_h,
+                "event_energy_kwh_per_day": event_kwh_d,
+                "event_cost_ttc_per_day": event_cost_ttc_d,
+                # Deltas
+                "delta_energy_kwh": round(delta_energy, 3),
+                "delta_cost_ht": round(delta_cost_ht, 2),
+                "delta_cost_ttc": round(delta_cost_ttc, 2),
+                "delta_energy_kwh_per_hour": round(event_kwh_h - baseline_kwh_h, 3),
+                "delta_cost_ttc_per_hour": round(event_cost_ttc_h - baseline_cost_ttc_h, 4),
+                "delta_energy_kwh_per_day": round(event_kwh_d - baseline_kwh_d, 3),
+                "delta_cost_ttc_per_day": round(event_cost_ttc_d - baseline_cost_ttc_d, 4),
+                # Pourcentages
+                "pct_energy_kwh": round(pct_energy, 1),
+                "pct_cost_ttc": round(pct_cost_ttc, 1),
+            }
 
-            # ═══════════════════════════════════════════════════════════
-            # 5. Calculer les coûts depuis l'énergie + prix
-            # ═══════════════════════════════════════════════════════════
-            entity_comparisons = []
-            baseline_duration_s = (baseline_end_dt - baseline_start_dt).total_seconds()
-            event_duration_s = (event_end_dt - event_start_dt).total_seconds()
-
-            for source_entity, info in sensors_map.items():
-                statistic_id = info["statistic_id"]
-                prix_ht = info["prix_ht"]
-                prix_ttc = info["prix_ttc"]
-
-                # === BASELINE ===
-                baseline_rows = baseline_stats.get(statistic_id, [])
-                if not baseline_rows:
-                    _LOGGER.debug(f"[COST-ANALYSIS] Pas de stats baseline pour {statistic_id}")
-                    continue
-
-                baseline_last = baseline_rows[-1].get("sum", 0.0) if baseline_rows else 0.0
-                baseline_first = baseline_rows[0].get("sum", 0.0) if baseline_rows else 0.0
-                baseline_energy_kwh = float(baseline_last) - float(baseline_first)
-
-                baseline_cost_ht = baseline_energy_kwh * prix_ht if prix_ht else 0.0
-                baseline_cost_ttc = baseline_energy_kwh * prix_ttc if prix_ttc else 0.0
-
-                # === EVENT ===
-                event_rows = event_stats.get(statistic_id, [])
-                if not event_rows:
-                    _LOGGER.debug(f"[COST-ANALYSIS] Pas de stats event pour {statistic_id}")
-                    continue
-
-                event_last = event_rows[-1].get("sum", 0.0) if event_rows else 0.0
-                event_first = event_rows[0].get("sum", 0.0) if event_rows else 0.0
-                event_energy_kwh = float(event_last) - float(event_first)
-
-                event_cost_ht = event_energy_kwh * prix_ht if prix_ht else 0.0
-                event_cost_ttc = event_energy_kwh * prix_ttc if prix_ttc else 0.0
-
-                if baseline_energy_kwh == 0.0 and event_energy_kwh == 0.0:
-                    continue
-
-                baseline_h = baseline_duration_s / 3600.0 if baseline_duration_s > 0 else 0.0
-                event_h = event_duration_s / 3600.0 if event_duration_s > 0 else 0.0
-                baseline_d = baseline_duration_s / 86400.0 if baseline_duration_s > 0 else 0.0
-                event_d = event_duration_s / 86400.0 if event_duration_s > 0 else 0.0
-
-                def safe_div(a, b, ndigits=3):
-                    return round(a / b, ndigits) if b > 0 else 0.0
-
-                baseline_kwh_h = safe_div(baseline_energy_kwh, baseline_h, 3)
-                event_kwh_h = safe_div(event_energy_kwh, event_h, 3)
-                baseline_cost_ttc_h = safe_div(baseline_cost_ttc, baseline_h, 4)
-                event_cost_ttc_h = safe_div(event_cost_ttc, event_h, 4)
-
-                baseline_kwh_d = safe_div(baseline_energy_kwh, baseline_d, 3)
-                event_kwh_d = safe_div(event_energy_kwh, event_d, 3)
-                baseline_cost_ttc_d = safe_div(baseline_cost_ttc, baseline_d, 4)
-                event_cost_ttc_d = safe_div(event_cost_ttc, event_d, 4)
-
-                delta_energy = event_energy_kwh - baseline_energy_kwh
-                delta_cost_ht = event_cost_ht - baseline_cost_ht
-                delta_cost_ttc = event_cost_ttc - baseline_cost_ttc
-
-                pct_energy = (
-                    safe_div(delta_energy, baseline_energy_kwh, 1) * 100
-                    if baseline_energy_kwh > 0
-                    else 0.0
-                )
-                pct_cost_ttc = (
-                    safe_div(delta_cost_ttc, baseline_cost_ttc, 1) * 100
-                    if baseline_cost_ttc > 0
-                    else 0.0
+            # 🆕 Séparer le capteur de référence des autres
+            if source_entity in reference_sources:
+                comparison["is_reference"] = True
+                reference_comparison = comparison
+                _LOGGER.info(
+                    "[COST-ANALYSIS] Capteur de référence identifié: %s",
+                    source_entity,
                 )
+            else:
+                comparison["is_reference"] = False
+                internal_comparisons.append(comparison)
+                total_baseline_kwh += comparison["baseline_energy_kwh"]
+                total_baseline_cost_ht += comparison["baseline_cost_ht"]
+                total_baseline_cost_ttc += comparison["baseline_cost_ttc"]
+                total_event_kwh += comparison["event_energy_kwh"]
+                total_event_cost_ht += comparison["event_cost_ht"]
+                total_event_cost_ttc += comparison["event_cost_ttc"]
+
+        compared_count = len(internal_comparisons) + (reference_comparison is not None)
+        _LOGGER.info(
+            "[COST-ANALYSIS] %s capteurs avec données comparées (%s sans consommation ignorés)",
+            compared_count,
+            skipped_zero,
+        )
 
-                comparison = {
-                    "entity_id": source_entity,
-                    "display_name": info["friendly_name"],
-                    "source_entity": source_entity,
-                    # Baseline
-                    "baseline_energy_kwh": round(baseline_energy_kwh, 3),
-                    "baseline_cost_ht": round(baseline_cost_ht, 2),
-                    "baseline_cost_ttc": round(baseline_cost_ttc, 2),
-                    "baseline_energy_kwh_per_hour": baseline_kwh_h,
-                    "baseline_cost_ttc_per_hour": baseline_cost_ttc_h,
-                    "baseline_energy_kwh_per_day": baseline_kwh_d,
-                    "baseline_cost_ttc_per_day": baseline_cost_ttc_d,
-                    # Event
-                    "event_energy_kwh": round(event_energy_kwh, 3),
-                    "event_cost_ht": round(event_cost_ht, 2),
-                    "event_cost_ttc": round(event_cost_ttc, 2),
-                    "event_energy_kwh_per_hour": event_kwh_h,
-                    "event_cost_ttc_per_hour": event_cost_ttc_h,
-                    "event_energy_kwh_per_day": event_kwh_d,
-                    "event_cost_ttc_per_day": event_cost_ttc_d,
-                    # Deltas
-                    "delta_energy_kwh": round(delta_energy, 3),
-                    "delta_cost_ht": round(delta_cost_ht, 2),
-                    "delta_cost_ttc": round(delta_cost_ttc, 2),
-                    "delta_energy_kwh_per_hour": round(event_kwh_h - baseline_kwh_h, 3),
-                    "delta_cost_ttc_per_hour": round(event_cost_ttc_h - baseline_cost_ttc_h, 4),
-                    "delta_energy_kwh_per_day": round(event_kwh_d - baseline_kwh_d, 3),
-                    "delta_cost_ttc_per_day": round(event_cost_ttc_d - baseline_cost_ttc_d, 4),
-                    # Pourcentages
-                    "pct_energy_kwh": round(pct_energy, 1),
-                    "pct_cost_ttc": round(pct_cost_ttc, 1),
-                }
-
-                entity_comparisons.append(comparison)
-
-            _LOGGER.info(
-                f"[COST-ANALYSIS] {len(entity_comparisons)} capteurs avec données comparées"
-            )
-
-            if not entity_comparisons:
-                return _empty_result()
+        if not compared_count:
+            return _empty_result()
 
-            # ═══════════════════════════════════════════════════════════
-            # 🆕 Séparer le capteur de référence des autres
-            # ═══════════════════════════════════════════════════════════
-            reference_comparison = None
-            internal_comparisons = []
+        # ═══════════════════════════════════════════════════════════
+        # Deltas sur les totaux (SANS le capteur de référence)
+        # ═══════════════════════════════════════════════════════════
+        delta_kwh = total_event_kwh - total_baseline_kwh
+        delta_cost_ht = total_event_cost_ht - total_baseline_cost_ht
+        delta_cost_ttc = total_event_cost_ttc - total_baseline_cost_ttc
 
-            for comparison in entity_comparisons:
-                source_entity = comparison.get("source_entity")
-                info = sensors_map.get(source_entity, {}) if source_entity else {}
+        delta_pct_kwh = (
+            (delta_kwh / total_baseline_kwh * 100.0) if total_baseline_kwh > 0 else 0.0
+        )
+        delta_pct_cost = (
+            (delta_cost_ttc / total_baseline_cost_ttc * 100.0)
+            if total_baseline_cost_ttc > 0
+            else 0.0
+        )
 
-                if info.get("is_reference"):
-                    comparison["is_reference"] = True
-                    reference_comparison = comparison
-                    _LOGGER.info(
-                        f"[COST-ANALYSIS] Capteur de référence identifié: {source_entity}"
-                    )
-                else:
-                    comparison["is_reference"] = False
-                    internal_comparisons.append(comparison)
-
-            # ═══════════════════════════════════════════════════════════
-            # Calculer les totaux (SANS le capteur de référence)
-            # ═══════════════════════════════════════════════════════════
-            total_baseline_kwh = sum(c["baseline_energy_kwh"] for c in internal_comparisons)
-            total_baseline_cost_ht = sum(c["baseline_cost_ht"] for c in internal_comparisons)
-            total_baseline_cost_ttc = sum(c["baseline_cost_ttc"] for c in internal_comparisons)
-
-            total_event_kwh = sum(c["event_energy_kwh"] for c in internal_comparisons)
-            total_event_cost_ht = sum(c["event_cost_ht"] for c in internal_comparisons)
-            total_event_cost_ttc = sum(c["event_cost_ttc"] for c in internal_comparisons)
-
-            delta_kwh = total_event_kwh - total_baseline_kwh
-            delta_cost_ht = total_event_cost_ht - total_baseline_cost_ht
-            delta_cost_ttc = total_event_cost_ttc - total_baseline_cost_ttc
-
-            delta_pct_kwh = (
-                (delta_kwh / total_baseline_kwh * 100.0) if total_baseline_kwh > 0 else 0.0
+        if abs(delta_pct_cost) < 5.0:
+            trend = "stable"
+        elif delta_cost_ttc > 0:
+            trend = "hausse"
+        else:
+            trend = "baisse"
+
+        # ═══════════════════════════════════════════════════════════
+        # Trier et séparer (SANS le capteur de référence)
+        # ═══════════════════════════════════════════════════════════
+        if sort_by == "energy_kwh":
+            internal_comparisons.sort(
+                key=lambda x: abs(x["delta_energy_kwh"]), reverse=True
             )
-            delta_pct_cost = (
-                (delta_cost_ttc / total_baseline_cost_ttc * 100.0)
-                if total_baseline_cost_ttc > 0
-                else 0.0
+        else:
+            internal_comparisons.sort(
+                key=lambda x: abs(x["delta_cost_ttc"]), reverse=True
             )
 
-            if abs(delta_pct_cost) < 5.0:
-                trend = "stable"
-            elif delta_cost_ttc > 0:
-                trend = "hausse"
-            else:
-                trend = "baisse"
-
-            # ═══════════════════════════════════════════════════════════
-            # Trier et séparer (SANS le capteur de référence)
-            # ═══════════════════════════════════════════════════════════
-            if sort_by == "energy_kwh":
-                internal_comparisons.sort(
-                    key=lambda x: abs(x["delta_energy_kwh"]), reverse=True
-                )
-            else:
-                internal_comparisons.sort(
-                    key=lambda x: abs(x["delta_cost_ttc"]), reverse=True
-                )
-
-            top_variations = internal_comparisons[:top_limit]
-            other_sensors = internal_comparisons[top_limit:]
-
-            top_consumers = sorted(
-                internal_comparisons, key=lambda x: x["event_cost_ttc"], reverse=True
-            )[:top_limit]
-
-            # ═══════════════════════════════════════════════════════════
-            # 🆕 Construire la réponse avec le capteur de référence séparé
-            # ═══════════════════════════════════════════════════════════
-            result = {
-                "baseline_period": {
-                    "start": baseline_start,
-                    "end": baseline_end,
-                    "total_kwh": round(total_baseline_kwh, 3),
-                    "total_cost_ht": round(total_baseline_cost_ht, 2),
-                    "total_cost_ttc": round(total_baseline_cost_ttc, 2),
-                    "sensor_count": len(internal_comparisons),
-                },
-                "event_period": {
-                    "start": event_start,
-                    "end": event_end,
-                    "total_kwh": round(total_event_kwh, 3),
-                    "total_cost_ht": round(total_event_cost_ht, 2),
-                    "total_cost_ttc": round(total_event_cost_ttc, 2),
-                    "sensor_count": len(internal_comparisons),
-                },
-                "total_comparison": {
-                    "delta_kwh": round(delta_kwh, 3),
-                    "delta_cost_ht": round(delta_cost_ht, 2),
-                    "delta_cost_ttc": round(delta_cost_ttc, 2),
-                    "delta_pct_kwh": round(delta_pct_kwh, 1),
-                    "delta_pct_cost": round(delta_pct_cost, 1),
-                    "trend": trend,
-                },
-                "reference_sensor": reference_comparison,
-                "top_variations": top_variations,
-                "top_consumers": top_consumers,
-                "other_sensors": other_sensors,
-                "timestamp": self._get_timestamp(),
-            }
+        top_variations = internal_comparisons[:top_limit]
+        other_sensors = internal_comparisons[top_limit:]
 
-            log_ref = ""
-            if reference_comparison:
-                try:
-                    log_ref = (
-                        f" | Référence: {reference_comparison.get('display_name')} "
-                        f"({reference_comparison.get('event_cost_ttc', 0.0):.2f}€)"
-                    )
-                except Exception:
-                    log_ref = " | Référence: (log failed)"
-
-            _LOGGER.info(
-                f"[COST-ANALYSIS] ✅ Analyse terminée: "
-                f"{len(top_variations)} top + {len(other_sensors)} autres{log_ref}"
-            )
+        # Top-N seul (pas de tri complet d'une 2e copie de la liste)
+        top_consumers = heapq.nlargest(
+            top_limit, internal_comparisons, key=lambda x: x["event_cost_ttc"]
+        )
 
-            return self._success(result)
+        # ═══════════════════════════════════════════════════════════
+        # 🆕 Construire la réponse avec le capteur de référence séparé
+        # ═══════════════════════════════════════════════════════════
+        result = {
+            "baseline_period": {
+                "start": baseline_start,
+                "end": baseline_end,
+                "total_kwh": round(total_baseline_kwh, 3),
+                "total_cost_ht": round(total_baseline_cost_ht, 2),
+                "total_cost_ttc": round(total_baseline_cost_ttc, 2),
+                "sensor_count": len(internal_comparisons),
+            },
+            "event_period": {
+                "start": event_start,
+                "end": event_end,
+                "total_kwh": round(total_event_kwh, 3),
+                "total_cost_ht": round(total_event_cost_ht, 2),
+                "total_cost_ttc": round(total_event_cost_ttc, 2),
+                "sensor_count": len(internal_comparisons),
+            },
+            "total_comparison": {
+                "delta_kwh": round(delta_kwh, 3),
+                "delta_cost_ht": round(delta_cost_ht, 2),
+                "delta_cost_ttc": round(delta_cost_ttc, 2),
+                "delta_pct_kwh": round(delta_pct_kwh, 1),
+                "delta_pct_cost": round(delta_pct_cost, 1),
+                "trend": trend,
+            },
+            "reference_sensor": reference_comparison,
+            "top_variations": top_variations,
+            "top_consumers": top_consumers,
+            "other_sensors": other_sensors,
+            "timestamp": self._get_timestamp(),
+        }
+
+        log_ref = ""
+        if reference_comparison and _LOGGER.isEnabledFor(logging.INFO):
+            try:
+                log_ref = (
+                    f" | Référence: {reference_comparison.get('display_name')} "
+                    f"({reference_comparison.get('event_cost_ttc', 0.0):.2f}€)"
+                )
+            except Exception:
+                log_ref = " | Référence: (log failed)"
+
+        _LOGGER.info(
+            "[COST-ANALYSIS] ✅ Analyse terminée: "
+            "%s top + %s autres%s",
+            len(top_variations),
+            len(other_sensors),
+            log_ref,
+        )
 
-        except Exception as e:
-            _LOGGER.exception(f"[COST-ANALYSIS] Erreur: {e}")
-            return self._error(500, str(e))
+        return self._success(result)
 
+    @_api_handler("[HISTORY-COSTS] Erreur", _error_message_payload)
     async def _fetch_history_costs(self, data):
         """
         POST /api/home_suivi_elec/history/costs
         Récupère les coûts historiques pour deux périodes
         """
-        try:
-            baseline_start = data.get("baseline_start")
-            baseline_end = data.get("baseline_end")
-            event_start = data.get("event_start")
-            event_end = data.get("event_end")
-            focus_entity_id = data.get("focus_entity_id")
-            group_by = data.get("group_by", "hour")
-            
-            _LOGGER.info(f"[HISTORY-COSTS] baseline: {baseline_start} → {baseline_end}")
-            _LOGGER.info(f"[HISTORY-COSTS] event: {event_start} → {event_end}")
-            
-            result = {
-                "baseline": {
-                    "start": baseline_start,
-                    "end": baseline_end,
-                    "total_kwh": 0.0,
-                    "total_cost_ht": 0.0,
-                    "total_cost_ttc": 0.0,
-                    "sensors": []
-                },
-                "event": {
-                    "start": event_start,
-                    "end": event_end,
-                    "total_kwh": 0.0,
-                    "total_cost_ht": 0.0,
-                    "total_cost_ttc": 0.0,
-                    "sensors": []
-                },
-                "comparison": {
-                    "delta_kwh": 0.0,
-                    "delta_cost_ht": 0.0,
-                    "delta_cost_ttc": 0.0,
-                    "delta_percent": 0.0
-                },
-                "focus_entity": focus_entity_id,
-                "group_by": group_by
-            }
-            
-            return self._success(result)
-            
-        except Exception as e:
-            _LOGGER.exception(f"[HISTORY-COSTS] Erreur: {e}")
-            return self._error(500, str(e))
+        params = {**_HISTORY_COSTS_DEFAULTS, **data}
+        baseline_start = params["baseline_start"]
+        baseline_end = params["baseline_end"]
+        event_start = params["event_start"]
+        event_end = params["event_end"]
+        focus_entity_id = params["focus_entity_id"]
+        group_by = params["group_by"]
+        
+        if _LOGGER.isEnabledFor(logging.INFO):
+            _LOGGER.info("[HISTORY-COSTS] baseline: %s → %s", baseline_start, baseline_end)
+            _LOGGER.info("[HISTORY-COSTS] event: %s → %s", event_start, event_end)
+        
+        body = _HISTORY_COSTS_TMPL % tuple(
+            _json_bytes(v)
+            for v in (baseline_start, baseline_end, event_start, event_end, focus_entity_id, group_by)
+        )
+        return web.Response(body=body, headers=_JSON_HEADERS)
     
+    @_api_handler("[HISTORY-ANALYSIS] Erreur", _error_message_payload)
     async def _analyze_comparison(self, data):
         """
         POST /api/home_suivi_elec/history/analysis
         Analyse comparative détaillée entre deux périodes
         """
-        try:
-            baseline_start = data.get("baseline_start")
-            baseline_end = data.get("baseline_end")
-            event_start = data.get("event_start")
-            event_end = data.get("event_end")
-            focus_entity_id = data.get("focus_entity_id")
-            group_by = data.get("group_by", "hour")
-            top_limit = data.get("top_limit", 10)
-            top_sort_by = data.get("top_sort_by", "cost_ttc")
-            
-            _LOGGER.info(f"[HISTORY-ANALYSIS] Analyse comparative demandée")
-            _LOGGER.info(f"[HISTORY-ANALYSIS] top {top_limit} by {top_sort_by}")
-            
-            result = {
-                "baseline_period": {
-                    "start": baseline_start,
-                    "end": baseline_end,
-                    "total_kwh": 0.0,
-                    "total_cost_ht": 0.0,
-                    "total_cost_ttc": 0.0,
-                    "sensor_count": 0
-                },
-                "event_period": {
-                    "start": event_start,
-                    "end": event_end,
-                    "total_kwh": 0.0,
-                    "total_cost_ht": 0.0,
-                    "total_cost_ttc": 0.0,
-                    "sensor_count": 0
-                },
-                "comparison": {
-                    "delta_kwh": 0.0,
-                    "delta_cost_ht": 0.0,
-                    "delta_cost_ttc": 0.0,
-                    "delta_percent_kwh": 0.0,
-                    "delta_percent_cost": 0.0,
-                    "trend": "stable"
-                },
-                "by_sensor": [],
-                "timeline": [],
-                "focus_entity": focus_entity_id,
-                "parameters": {
-                    "group_by": group_by,
-                    "top_limit": top_limit,
-                    "top_sort_by": top_sort_by
-                }
-            }
-            
-            return self._success(result)
-            
-        except Exception as e:
-            _LOGGER.exception(f"[HISTORY-ANALYSIS] Erreur: {e}")
-            return self._error(500, str(e))
+        params = {**_HISTORY_ANALYSIS_DEFAULTS, **data}
+        baseline_start = params["baseline_start"]
+        baseline_end = params["baseline_end"]
+        event_start = params["event_start"]
+        event_end = params["event_end"]
+        focus_entity_id = params["focus_entity_id"]
+        group_by = params["group_by"]
+        top_limit = params["top_limit"]
+        top_sort_by = params["top_sort_by"]
+        
+        if _LOGGER.isEnabledFor(logging.INFO):
+            _LOGGER.info("[HISTORY-ANALYSIS] Analyse comparative demandée")
+            _LOGGER.info("[HISTORY-ANALYSIS] top %s by %s", top_limit, top_sort_by)
+        
+        body = _HISTORY_ANALYSIS_TMPL % tuple(
+            _json_bytes(v)
+            for v in (
+                baseline_start,
+                baseline_end,
+                event_start,
+                event_end,
+                focus_entity_id,
+                group_by,
+                top_limit,
+                top_sort_by,
+            )
+        )
+        return web.Response(body=body, headers=_JSON_HEADERS)
     
     # === HELPERS ===
     
     def _success(self, data: Any) -> web.Response:
-        return web.Response(
-            text=json.dumps({"error": False, "data": data}, default=_json_default),
-            content_type="application/json"
-        )
+        return json_response({"error": False, "data": data})
     
     def _error(self, status: int, message: str) -> web.Response:
-        return web.Response(
-            text=json.dumps({"error": True, "message": message}, default=_json_default),
-            content_type="application/json",
-            status=status
-        )
+        return json_response({"error": True, "message": message}, status=status)
+    
+    async def _success_stream(
+        self, request: web.Request, data: Dict[str, Any], array_key: str
+    ) -> web.StreamResponse:
+        """_success en streaming si data[array_key] est longue, sinon réponse classique."""
+        if len(data.get(array_key) or ()) < _STREAM_MIN_ITEMS:
+            return self._success(data)
+        return await _stream_json_success(request, data, array_key)
     
     def _get_timestamp(self) -> str:
-        return datetime.now().isoformat()
+        return _iso_timestamp()
 
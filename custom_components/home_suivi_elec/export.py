@@ -1,7 +1,7 @@
 # custom_components/home_suivi_elec/export.py
 from __future__ import annotations
 
-from typing import Any, Dict, List, Tuple
+from typing import Any, AsyncIterator, Dict, List, Tuple
 from pathlib import Path
 import json
 import logging
@@ -18,6 +18,16 @@ COMPONENT_DIR = Path(__file__).parent
 DATA_DIR = COMPONENT_DIR / "data"
 POWER_FILE = DATA_DIR / "capteurs_power.json"
 
+
+def _dump_yaml(content: Any) -> str:
+    """yaml.dump avec les options d'export HSE (bloc, unicode, ordre conservé)."""
+    return yaml.dump(
+        content,
+        default_flow_style=False,
+        allow_unicode=True,
+        sort_keys=False,
+    )
+
 def _to_float(v: Any, default: float = 0.0) -> float:
     try:
         return float(v)
@@ -473,10 +483,23 @@ class ExportService:
         - 2 capteurs par entité: HT et TTC
         - Prix injectés depuis options utilisateur au moment de la génération.
         """
+        return "".join([chunk async for chunk in self.iter_cost_sensors_yaml()])
+
+    async def iter_cost_sensors_yaml(self) -> AsyncIterator[str]:
+        """
+        Même YAML que generate_cost_sensors_yaml, produit par morceaux (un par capteur coût).
+
+        Chaque élément de la liste "template" est dumpé seul : PyYAML n'indente pas les
+        séquences sous une clé, la concaténation est donc identique au dump complet.
+        """
         sensors = await self._get_enabled_sensors()
         pricing = self._get_pricing_from_options()
 
-        templates: List[Dict[str, Any]] = []
+        if not sensors:
+            yield _dump_yaml({"template": []})
+            return
+
+        yield "template:\n"
 
         for sensor in sensors:
             eid = sensor["entity_id"]
@@ -484,42 +507,21 @@ class ExportService:
             short = eid.split(".", 1)[1]
 
             prix_ht, prix_ttc = self._pick_price_for_entity(pricing, eid)
+            availability = f"{{{{ states('{eid}') not in ['unknown','unavailable','none'] }}}}"
 
-            # Coût HT
-            templates.append(
-                {
-                    "name": f"{friendly} Coût HT",
-                    "unique_id": f"{short}_cost_ht",
-                    "state": (
-                        f"{{{{ (states('{eid}') | float(0) * {prix_ht}) | round(2) }}}}"
-                    ),
-                    "unit_of_measurement": "€",
-                    "device_class": "monetary",
-                    "state_class": "total",
-                    "availability": f"{{{{ states('{eid}') not in ['unknown','unavailable','none'] }}}}",
-                }
-            )
-
-            # Coût TTC
-            templates.append(
-                {
-                    "name": f"{friendly} Coût TTC",
-                    "unique_id": f"{short}_cost_ttc",
-                    "state": (
-                        f"{{{{ (states('{eid}') | float(0) * {prix_ttc}) | round(2) }}}}"
-                    ),
-                    "unit_of_measurement": "€",
-                    "device_class": "monetary",
-                    "state_class": "total",
-                    "availability": f"{{{{ states('{eid}') not in ['unknown','unavailable','none'] }}}}",
-                }
-            )
-
-        yaml_content = {"template": templates}
-        yaml_str = yaml.dump(
-            yaml_content,
-            default_flow_style=False,
-            allow_unicode=True,
-            sort_keys=False,
-        )
-        return yaml_str
+            for label, suffix, price in (("HT", "ht", prix_ht), ("TTC", "ttc", prix_ttc)):
+                yield _dump_yaml(
+                    [
+                        {
+                            "name": f"{friendly} Coût {label}",
+                            "unique_id": f"{short}_cost_{suffix}",
+                            "state": (
+                                f"{{{{ (states('{eid}') | float(0) * {price}) | round(2) }}}}"
+                            ),
+                            "unit_of_measurement": "€",
+                            "device_class": "monetary",
+                            "state_class": "total",
+                            "availability": availability,
+                        }
+                    ]
+                )
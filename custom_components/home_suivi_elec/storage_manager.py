@@ -473,6 +473,19 @@ class StorageManager:
             _LOGGER.exception("STORAGE Erreur save_cost_ha_config: %s", e)
             return False
 
+    async def merge_cost_ha_config(self, updates: Dict[str, Any]) -> bool:
+        """
+        Fusionne `updates` dans la map cost_ha puis sauvegarde le store complet.
+
+        Le Store HA est un document JSON unique : toute écriture réécrit le
+        fichier entier. Seul gain : aucune écriture si `updates` est vide.
+        """
+        if not updates:
+            return True
+        sensors_map = dict(await self.get_cost_ha_config())
+        sensors_map.update(updates)
+        return await self.save_cost_ha_config(sensors_map)
+
     async def ensure_cost_sensor_for(self, entity_id: str, enabled: bool) -> Dict[str, Any]:
         sensors_map = await self.get_cost_ha_config()
 
@@ -1,30 +1,35 @@
 """
 Helper centralisé pour les réponses JSON avec support datetime
 """
-import json
-from datetime import datetime, date
+import orjson
 from aiohttp import web
 
 
 def _json_default(obj):
-    """Serializer JSON custom pour datetime/date"""
-    if isinstance(obj, (datetime, date)):
-        return obj.isoformat()
+    """Types non natifs pour orjson (datetime/date le sont déjà) : ensembles -> listes"""
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
     raise TypeError(f"Type {type(obj)} not serializable")
 
 
+def json_dumps_bytes(data) -> bytes:
+    """Encode en JSON (bytes) via orjson ; clés non-str acceptées comme avec json.dumps."""
+    return orjson.dumps(data, default=_json_default, option=orjson.OPT_NON_STR_KEYS)
+
+
 def json_response(data, *, status=200, **kwargs) -> web.Response:
     """
-    Wrapper pour web.json_response avec support datetime automatique
-    
+    Wrapper pour les réponses JSON avec support datetime automatique
+
+    Le corps est encodé une seule fois en bytes (orjson), sans passer par une str.
+
     Usage:
         return json_response({"data": some_data})
         return json_response({"error": "message"}, status=400)
     """
-    return web.json_response(
-        data,
+    kwargs.setdefault("content_type", "application/json")
+    return web.Response(
+        body=json_dumps_bytes(data),
         status=status,
-        dumps=lambda x: json.dumps(x, default=_json_default),
         **kwargs
     )
-